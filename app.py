@@ -7,16 +7,12 @@ from datetime import date
 from dateutil.relativedelta import relativedelta
 
 from database import (
-    init_db, get_doctors, delete_old_schedules,
+    init_db, get_doctors, get_clinics, delete_old_schedules,
     is_admin_password_set, set_admin_password, verify_admin_password,
     is_doctor_individual_password_set, set_doctor_individual_password,
     verify_doctor_individual_password, update_doctor_email,
 )
 from optimizer import get_target_saturdays
-from pages import (
-    admin_master, admin_preferences, admin_generate,
-    admin_schedule, doctor_input, doctor_schedule,
-)
 
 # ---- 初期設定 ----
 st.set_page_config(
@@ -25,14 +21,25 @@ st.set_page_config(
     initial_sidebar_state="collapsed",
 )
 
-# サイドバーを完全に非表示
-st.markdown(
-    "<style>[data-testid='stSidebar']{display:none}</style>",
-    unsafe_allow_html=True,
-)
+# サイドバー（pages/ の自動ナビゲーション）は .streamlit/config.toml で非表示
+
+
+@st.cache_resource(show_spinner=False)
+def _bootstrap():
+    """シート初期化（プロセスごとに1回のみ）"""
+    init_db()
+    return True
+
+
+@st.cache_resource(ttl=86400, show_spinner=False)
+def _daily_cleanup():
+    """古い月別シートの削除（1日1回のみ）"""
+    delete_old_schedules(months_to_keep=4)
+    return True
 
-init_db()
-delete_old_schedules(months_to_keep=4)
+
+_bootstrap()
+_daily_cleanup()
 
 # ---- セッション状態初期化 ----
 if "role" not in st.session_state:
@@ -45,17 +52,103 @@ if "doctor_authenticated" not in st.session_state:
     st.session_state.doctor_authenticated = False
 
 
+@st.cache_data(ttl=60, show_spinner=False)
+def _cached_doctors():
+    """有効な医員一覧・id / 名前の索引・選択肢用の名前タプル（リランごとのシートアクセスを避けるためキャッシュ）"""
+    doctors = get_doctors()
+    by_id = {d["id"]: d for d in doctors}
+    by_name = {d["name"]: d for d in doctors}
+    names = tuple(d["name"] for d in doctors)
+    return doctors, by_id, by_name, names
+
+
+@st.cache_data(ttl=86400, max_entries=12, show_spinner=False)
+def _saturday_count(year, month):
+    """対象月の土曜日数（祝日除く）"""
+    return len(get_target_saturdays(year, month))
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _month_options(today_iso):
+    """対象月の選択肢（当月から4ヶ月分、YYYY-MM）"""
+    today = date.fromisoformat(today_iso)
+    return tuple((today + relativedelta(months=i)).strftime("%Y-%m") for i in range(4))
+
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _page_ctx(year, month):
+    """タブ共通の参照データ（有効な医員・外勤先、対象土曜日）をまとめて取得"""
+    return {
+        "doctors": get_doctors(),
+        "clinics": get_clinics(),
+        "saturdays": get_target_saturdays(year, month),
+    }
+
+
+# ---- ボタンコールバック ----
+# on_click で状態を更新すると、ボタン押下に伴う通常のリランで画面が切り替わる
+# （ボタン本体で状態を変えて st.rerun() すると同じ画面を2回実行することになる）
+
+def _select_role(role):
+    """ロールを切り替える（None でロール選択画面に戻る）"""
+    st.session_state.role = role
+
+
+def _set_initial_admin_password():
+    """初回の管理者パスワードを設定してログイン"""
+    pw1 = st.session_state.get("pw_new1", "")
+    pw2 = st.session_state.get("pw_new2", "")
+    if not pw1:
+        st.session_state.login_error = "パスワードを入力してください"
+    elif pw1 != pw2:
+        st.session_state.login_error = "パスワードが一致しません"
+    else:
+        set_admin_password(pw1)
+        st.session_state.admin_authenticated = True
+
+
+def _admin_login():
+    """管理者パスワードを検証してログイン"""
+    if verify_admin_password(st.session_state.get("pw_login", "")):
+        st.session_state.admin_authenticated = True
+    else:
+        st.session_state.login_error = "パスワードが正しくありません"
+
+
+def _doctor_login(doctor_id):
+    """医員の個別パスワードを検証してログイン"""
+    if verify_doctor_individual_password(doctor_id, st.session_state.get("doc_pw_login", "")):
+        st.session_state.doctor_authenticated = True
+        st.session_state.doctor_id = doctor_id
+    else:
+        st.session_state.login_error = "パスワードが正しくありません"
+
+
+def _logout():
+    """ログアウトしてロール選択画面に戻る"""
+    st.session_state.role = None
+    st.session_state.admin_authenticated = False
+    st.session_state.doctor_authenticated = False
+    st.session_state.doctor_id = None
+    st.session_state.pop("show_doctor_settings", None)
+
+
+def _show_login_error():
+    """コールバックで記録されたログインエラーを表示"""
+    error = st.session_state.pop("login_error", None)
+    if error:
+        st.error(error)
+
+
 def _show_role_selection():
     """ロール選択画面"""
     st.title("外勤調整システム")
     st.markdown("---")
 
-    if st.button("管理者としてログイン", use_container_width=True, type="primary"):
-        st.session_state.role = "admin"
-        st.rerun()
-    if st.button("医員としてログイン", use_container_width=True, type="primary"):
-        st.session_state.role = "doctor"
-        st.rerun()
+    st.button("管理者としてログイン", use_container_width=True, type="primary",
+              key="role_admin", on_click=_select_role, args=("admin",))
+    st.button("医員としてログイン", use_container_width=True, type="primary",
+              key="role_doctor", on_click=_select_role, args=("doctor",))
 
 
 def _show_admin_login():
@@ -65,31 +158,17 @@ def _show_admin_login():
 
     if not is_admin_password_set():
         st.info("管理者パスワードが未設定です。初回パスワードを設定してください。")
-        pw1 = st.text_input("パスワード", type="password", key="pw_new1")
-        pw2 = st.text_input("パスワード（確認）", type="password", key="pw_new2")
-        if st.button("パスワードを設定", type="primary"):
-            if not pw1:
-                st.error("パスワードを入力してください")
-            elif pw1 != pw2:
-                st.error("パスワードが一致しません")
-            else:
-                set_admin_password(pw1)
-                st.session_state.admin_authenticated = True
-                st.success("パスワードを設定しました")
-                st.rerun()
+        st.text_input("パスワード", type="password", key="pw_new1")
+        st.text_input("パスワード（確認）", type="password", key="pw_new2")
+        st.button("パスワードを設定", type="primary", key="admin_pw_set",
+                  on_click=_set_initial_admin_password)
     else:
-        pw = st.text_input("パスワード", type="password", key="pw_login")
-        if st.button("ログイン", type="primary"):
-            if verify_admin_password(pw):
-                st.session_state.admin_authenticated = True
-                st.rerun()
-            else:
-                st.error("パスワードが正しくありません")
+        st.text_input("パスワード", type="password", key="pw_login")
+        st.button("ログイン", type="primary", key="admin_login", on_click=_admin_login)
+    _show_login_error()
 
     st.markdown("---")
-    if st.button("← 戻る"):
-        st.session_state.role = None
-        st.rerun()
+    st.button("← 戻る", key="admin_login_back", on_click=_select_role, args=(None,))
 
 
 def _show_doctor_login():
@@ -97,36 +176,28 @@ def _show_doctor_login():
     st.title("医員ログイン")
     st.markdown("---")
 
-    doctors = get_doctors()
+    doctors, _, doctors_by_name, doctor_names = _cached_doctors()
     if not doctors:
         st.warning("医員が登録されていません。管理者にお問い合わせください。")
     else:
-        doctor_names = [d["name"] for d in doctors]
-        selected = st.selectbox("名前を選択してください", doctor_names)
-        doctor = next(d for d in doctors if d["name"] == selected)
+        selected = st.selectbox("名前を選択してください", doctor_names, key="doctor_login_name")
+        doctor = doctors_by_name[selected]
 
         if not is_doctor_individual_password_set(doctor["id"]):
             st.info("パスワードが未設定です。管理者に初期パスワードの設定を依頼してください。")
         else:
-            pw = st.text_input("パスワード", type="password", key="doc_pw_login")
-            if st.button("ログイン", type="primary"):
-                if verify_doctor_individual_password(doctor["id"], pw):
-                    st.session_state.doctor_authenticated = True
-                    st.session_state.doctor_id = doctor["id"]
-                    st.rerun()
-                else:
-                    st.error("パスワードが正しくありません")
+            st.text_input("パスワード", type="password", key="doc_pw_login")
+            st.button("ログイン", type="primary", key="doctor_login",
+                      on_click=_doctor_login, args=(doctor["id"],))
+            _show_login_error()
 
     st.markdown("---")
-    if st.button("← 戻る"):
-        st.session_state.role = None
-        st.rerun()
+    st.button("← 戻る", key="doctor_login_back", on_click=_select_role, args=(None,))
 
 
 def _show_header(title, doctor=None):
     """ヘッダー：タイトル・対象月セレクタ・設定・ログアウト"""
-    today = date.today()
-    months = [(today + relativedelta(months=i)).strftime("%Y-%m") for i in range(4)]
+    months = _month_options(date.today().isoformat())
 
     if doctor:
         col_title, col_month, col_settings, col_logout = st.columns([3, 2, 1, 1])
@@ -137,33 +208,28 @@ def _show_header(title, doctor=None):
         st.markdown(f"**{title}**")
     with col_month:
         target_month = st.selectbox(
-            "対象月", months, label_visibility="collapsed",
+            "対象月", months, label_visibility="collapsed", key="target_month_hdr",
         )
     if col_settings and doctor:
         with col_settings:
-            if st.button("⚙ 設定", use_container_width=True):
+            if st.button("⚙ 設定", use_container_width=True, key="open_doctor_settings"):
                 st.session_state.show_doctor_settings = True
     with col_logout:
-        if st.button("ログアウト", use_container_width=True):
-            st.session_state.role = None
-            st.session_state.admin_authenticated = False
-            st.session_state.doctor_authenticated = False
-            st.session_state.doctor_id = None
-            st.session_state.pop("show_doctor_settings", None)
-            st.rerun()
+        st.button("ログアウト", use_container_width=True, key="logout", on_click=_logout)
 
     # 医員設定ダイアログ（パスワード変更・メールアドレス設定）
     if doctor and st.session_state.get("show_doctor_settings"):
         _show_doctor_settings(doctor)
 
     year, month = map(int, target_month.split("-"))
-    st.caption(f"対象土曜日数: {len(get_target_saturdays(year, month))}日")
+    st.caption(f"対象土曜日数: {_saturday_count(year, month)}日")
     st.markdown("---")
     return target_month, year, month
 
 
+@st.fragment
 def _show_doctor_settings(doctor):
-    """医員設定: パスワード変更・メールアドレス設定"""
+    """医員設定: パスワード変更・メールアドレス設定（フラグメント内でのみ再実行）"""
     with st.expander("アカウント設定", expanded=True):
         tab_pw, tab_email = st.tabs(["パスワード変更", "メールアドレス設定"])
 
@@ -193,10 +259,11 @@ def _show_doctor_settings(doctor):
                 new_email = st.text_input("メールアドレス", value=current_email)
                 if st.form_submit_button("メールアドレスを保存"):
                     update_doctor_email(doctor["id"], new_email.strip())
+                    st.cache_data.clear()
                     st.success("メールアドレスを保存しました")
                     st.rerun()
 
-        if st.button("設定を閉じる"):
+        if st.button("設定を閉じる", key="close_doctor_settings"):
             st.session_state.pop("show_doctor_settings", None)
             st.rerun()
 
@@ -209,7 +276,11 @@ elif st.session_state.role == "admin":
     if not st.session_state.admin_authenticated:
         _show_admin_login()
     else:
+        # ページモジュールはロールに応じて必要な分だけ読み込む
+        from pages import admin_master, admin_preferences, admin_generate, admin_schedule
+
         target_month, year, month = _show_header("管理者メニュー")
+        ctx = _page_ctx(year, month)
 
         tab1, tab2, tab3, tab4 = st.tabs([
             "マスタ管理", "希望状況一覧",
@@ -217,30 +288,33 @@ elif st.session_state.role == "admin":
         ])
 
         with tab1:
-            admin_master.render(target_month, year, month)
+            admin_master.render(target_month, year, month, ctx)
         with tab2:
-            admin_preferences.render(target_month, year, month)
+            admin_preferences.render(target_month, year, month, ctx)
         with tab3:
-            admin_generate.render(target_month, year, month)
+            admin_generate.render(target_month, year, month, ctx)
         with tab4:
-            admin_schedule.render(target_month)
+            admin_schedule.render(target_month, ctx)
 
 elif st.session_state.role == "doctor":
     if not st.session_state.doctor_authenticated:
         _show_doctor_login()
     else:
-        doctors = get_doctors()
-        doctor = next((d for d in doctors if d["id"] == st.session_state.doctor_id), None)
+        _, doctors_by_id, _, _ = _cached_doctors()
+        doctor = doctors_by_id.get(st.session_state.doctor_id)
         if doctor is None:
             st.session_state.doctor_authenticated = False
             st.session_state.doctor_id = None
             st.rerun()
         else:
+            from pages import doctor_input, doctor_schedule
+
             target_month, year, month = _show_header(doctor['name'], doctor=doctor)
+            ctx = _page_ctx(year, month)
 
             tab1, tab2 = st.tabs(["希望入力", "スケジュール確認"])
 
             with tab1:
-                doctor_input.render(doctor, target_month, year, month)
+                doctor_input.render(doctor, target_month, year, month, ctx)
             with tab2:
-                doctor_schedule.render(doctor, target_month)
+                doctor_schedule.render(doctor, target_month, ctx)
@@ -1,40 +1,53 @@
 """スケジュール表の共通表示コンポーネント"""
 import streamlit as st
 import pandas as pd
-from datetime import date
+
+
+@st.cache_data(ttl=3600, max_entries=16, show_spinner=False)
+def _id_name_maps(doctors, clinics):
+    """((id, name), ...) から医員・外勤先の id→名前マップを生成"""
+    return dict(doctors), dict(clinics)
+
+
+@st.cache_data(ttl=3600, max_entries=64, show_spinner=False)
+def _build_schedule_df(assignments, doctors, clinics):
+    """カレンダー形式の DataFrame を生成（引数はハッシュ可能なタプル）
+
+    assignments: ((date, clinic_id, doctor_id), ...)
+    doctors / clinics: ((id, name), ...)
+    """
+    if not assignments:
+        return None
+    doc_map, clinic_map = _id_name_maps(doctors, clinics)
+
+    adf = pd.DataFrame(list(assignments), columns=["date", "clinic_id", "doctor_id"])
+    adf["外勤先"] = adf["clinic_id"].map(clinic_map).fillna("?")
+    adf["doctor"] = adf["doctor_id"].map(doc_map).fillna("?")
+    adf["date"] = pd.to_datetime(adf["date"])
+
+    # 行=外勤先、列=日付、セル=医員名（同一スロットは後勝ち）
+    pivot = adf.pivot_table(
+        index="外勤先", columns="date", values="doctor",
+        aggfunc="last", fill_value="-",
+    )
+    pivot.columns = pivot.columns.strftime("%m/%d(%a)")
+    df = pivot.reset_index()
+    df.columns.name = None
+    return df
 
 
 def render_schedule_table(sched, doctors, clinics):
     """スケジュールをカレンダー形式のテーブルで表示する"""
-    doc_map = {d["id"]: d["name"] for d in doctors}
-    clinic_map = {c["id"]: c["name"] for c in clinics}
-
-    cal_data = {}
-    for a in sched["assignments"]:
-        ds = a["date"]
-        cname = clinic_map.get(a["clinic_id"], "?")
-        dname = doc_map.get(a["doctor_id"], "?")
-        if ds not in cal_data:
-            cal_data[ds] = {}
-        cal_data[ds][cname] = dname
-
-    if not cal_data:
+    if not sched.get("assignments"):
+        return None
+
+    df = _build_schedule_df(
+        tuple((a["date"], a["clinic_id"], a["doctor_id"]) for a in sched["assignments"]),
+        tuple((d["id"], d["name"]) for d in doctors),
+        tuple((c["id"], c["name"]) for c in clinics),
+    )
+    if df is None:
         return None
 
-    dates_sorted = sorted(cal_data.keys())
-    all_clinic_names = sorted(set(
-        cn for day_data in cal_data.values() for cn in day_data.keys()
-    ))
-
-    rows = []
-    for cn in all_clinic_names:
-        row = {"外勤先": cn}
-        for ds in dates_sorted:
-            d_obj = date.fromisoformat(ds)
-            col_name = d_obj.strftime("%m/%d(%a)")
-            row[col_name] = cal_data.get(ds, {}).get(cn, "-")
-        rows.append(row)
-
-    df = pd.DataFrame(rows)
     st.dataframe(df, use_container_width=True, hide_index=True)
     return df
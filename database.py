@@ -2,28 +2,37 @@
 データベース管理モジュール
 Google スプレッドシートで医員・外勤先・希望・スケジュールを永続化
 """
-import json
+import os
 import hashlib
+import hmac
 import time
+import functools
 from datetime import datetime
 import gspread
+import orjson
+from gspread.utils import ValueInputOption, absolute_range_name, rowcol_to_a1
 import streamlit as st
 
 
 def _safe_json_loads(val, default=None):
-    """gspreadが自動パースしたリスト/dictにも対応するjson.loads"""
+    """gspreadが自動パースしたリスト/dictにも対応するjson.loads（orjsonで高速化）"""
     if default is None:
         default = []
     if isinstance(val, (list, dict)):
         return val
     if isinstance(val, str) and val:
         try:
-            return json.loads(val)
-        except (json.JSONDecodeError, ValueError):
+            return orjson.loads(val)
+        except orjson.JSONDecodeError:
             return default
     return default
 
 
+def _json_dumps(obj):
+    """JSON文字列に変換（orjsonで高速化）"""
+    return orjson.dumps(obj).decode()
+
+
 # ---- スプレッドシート接続 ----
 
 @st.cache_resource
@@ -51,6 +60,25 @@ def _retry(func, *args, max_retries=3, **kwargs):
 
 
 _ws_cache = {}
+_ws_listed_at = None  # 未取得なら None（初回は必ず一覧を取得する）
+_WS_LIST_TTL = 60
+
+
+def _list_worksheets():
+    """全シートの一覧を取得（sh.worksheets() の結果を _ws_cache に載せて60秒間再利用）"""
+    global _ws_listed_at
+    if _ws_listed_at is None or time.monotonic() - _ws_listed_at > _WS_LIST_TTL:
+        listed = {ws.title: ws for ws in _retry(_get_spreadsheet().worksheets)}
+        _ws_cache.clear()
+        _ws_cache.update(listed)
+        _ws_listed_at = time.monotonic()
+    return list(_ws_cache.values())
+
+
+def _invalidate_worksheet_list():
+    """シート一覧を破棄し、次の _list_worksheets() で取り直す（他プロセスでの削除に追従）"""
+    global _ws_listed_at
+    _ws_listed_at = None
 
 
 def _get_sheet(name):
@@ -66,28 +94,120 @@ def _get_sheet(name):
     return ws
 
 
+# ---- 読み取りキャッシュ ----
+# get_all_records はシート全体を取得する HTTP 呼び出しのため、シート名単位で短時間キャッシュする。
+# 書き込み関数は @_writes で修飾し、実行後にキャッシュを破棄する。
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _cached_records(sheet_title):
+    """シートの全レコードを取得（キャッシュ+リトライ付き）"""
+    return _retry(_get_sheet(sheet_title).get_all_records)
+
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _cached_headers(sheet_title):
+    """シートのヘッダー行を取得（キャッシュ+リトライ付き）"""
+    return _retry(_get_sheet(sheet_title).row_values, 1)
+
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _cached_batch_records(sheet_titles):
+    """複数シートの全レコードを1回の batchGet で取得（sheet_titles はタプル、戻り値は {シート名: レコード}）"""
+    if not sheet_titles:
+        return {}
+    ranges = [absolute_range_name(t) for t in sheet_titles]
+    resp = _retry(_get_spreadsheet().values_batch_get, ranges,
+                  params={"valueRenderOption": "UNFORMATTED_VALUE"})
+    result = {}
+    for title, vr in zip(sheet_titles, resp.get("valueRanges", [])):
+        values = vr.get("values", [])
+        if not values:
+            result[title] = []
+            continue
+        headers = values[0]
+        result[title] = [
+            {h: (row[j] if j < len(row) else "") for j, h in enumerate(headers)}
+            for row in values[1:]
+        ]
+    return result
+
+
+def _writes(func):
+    """書き込み関数用デコレータ: 実行後に読み取りキャッシュを破棄"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _cached_records.clear()
+            _cached_headers.clear()
+            _cached_index.clear()
+            _cached_batch_records.clear()
+            _cached_overrides_by_month.clear()
+    return wrapper
+
+
 def _get_all_records(ws):
-    """シートの全レコードを辞書リストで取得（リトライ付き）"""
-    return _retry(ws.get_all_records)
-
-
-def _find_row_index(ws, col, value):
-    """指定列でvalueが一致する行番号を返す（1-indexed、ヘッダー=1行目）"""
-    col_values = _retry(ws.col_values, col)
-    for i, v in enumerate(col_values):
-        if i == 0:
-            continue  # ヘッダー行スキップ
-        if str(v) == str(value):
-            return i + 1  # gspreadは1-indexed
-    return None
+    """シートの全レコードを辞書リストで取得（キャッシュ経由）"""
+    return _cached_records(ws.title)
+
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _cached_index(sheet_title):
+    """A列の値 → 行番号（1-indexed、ヘッダー=1行目）の索引（キャッシュ済みレコードから生成）"""
+    headers = _cached_headers(sheet_title)
+    if not headers:
+        return {}
+    key = headers[0]
+    index = {}
+    for i, r in enumerate(_cached_records(sheet_title)):
+        index.setdefault(str(r.get(key, "")), i + 2)  # 重複時は先頭行を優先
+    return index
+
+
+def _find_row_index(ws, value):
+    """A列でvalueが一致する行番号を返す（1-indexed、ヘッダー=1行目）"""
+    return _cached_index(ws.title).get(str(value))
+
+
+def _apply_updates(ws, row_idx, field_values):
+    """指定行の複数カラムを1回の batch_update で更新（カラムはヘッダー名で指定）"""
+    headers = _cached_headers(ws.title)
+    data = [
+        {"range": rowcol_to_a1(row_idx, headers.index(key) + 1), "values": [[val]]}
+        for key, val in field_values.items()
+        if key in headers
+    ]
+    if data:
+        _retry(ws.batch_update, data, value_input_option=ValueInputOption.user_entered)
+
+
+def _delete_rows_batch(targets):
+    """複数シートの行を1回の batchUpdate（deleteDimension）で削除
+
+    targets: [(ws, row_idx), ...]（row_idx は1-indexed）
+    """
+    if not targets:
+        return
+    # 行番号がずれないよう下の行から削除する
+    requests = [
+        {"deleteDimension": {"range": {
+            "sheetId": ws.id, "dimension": "ROWS",
+            "startIndex": row - 1, "endIndex": row,
+        }}}
+        for ws, row in sorted(targets, key=lambda t: t[1], reverse=True)
+    ]
+    _retry(_get_spreadsheet().batch_update, {"requests": requests})
+
 
+def _now_str():
+    """現在時刻を "YYYY-MM-DD HH:MM:SS" 形式で返す"""
+    return time.strftime("%Y-%m-%d %H:%M:%S")
 
-def _next_id(ws):
-    """idカラム(A列)の最大値+1を返す"""
-    col_values = _retry(ws.col_values, 1)
-    if len(col_values) <= 1:
-        return 1
-    ids = [int(v) for v in col_values[1:] if v.isdigit()]
+
+def _next_id(records):
+    """取得済みレコードの id の最大値+1を返す"""
+    ids = [int(v) for v in (str(r.get("id", "")) for r in records) if v.isdigit()]
     return max(ids) + 1 if ids else 1
 
 
@@ -105,14 +225,22 @@ SHEET_HEADERS = {
 _db_initialized = False
 
 
+@_writes
 def init_db():
     """全シートを初期化（ヘッダーがなければ作成、不足カラムがあれば追加）"""
     global _db_initialized
     if _db_initialized:
         return
     sh = _get_spreadsheet()
-    existing = {ws.title: ws for ws in _retry(sh.worksheets)}
-    _ws_cache.update(existing)
+    existing = {ws.title: ws for ws in _list_worksheets()}
+    # 既存シートのヘッダー行を1回の batchGet でまとめて取得
+    present = [name for name in SHEET_HEADERS if name in existing]
+    header_rows = {}
+    if present:
+        resp = _retry(sh.values_batch_get, [absolute_range_name(name, "1:1") for name in present])
+        for name, vr in zip(present, resp.get("valueRanges", [])):
+            values = vr.get("values", [])
+            header_rows[name] = values[0] if values else []
     for sheet_name, headers in SHEET_HEADERS.items():
         if sheet_name not in existing:
             ws = sh.add_worksheet(title=sheet_name, rows=100, cols=len(headers))
@@ -120,7 +248,7 @@ def init_db():
             _ws_cache[sheet_name] = ws
         else:
             ws = existing[sheet_name]
-            existing_headers = _retry(ws.row_values, 1)
+            existing_headers = header_rows.get(sheet_name, [])
             if not existing_headers:
                 ws.update([headers], "A1")
             else:
@@ -165,57 +293,71 @@ def get_doctors(active_only=True):
     return result
 
 
+def _doctor_name_map():
+    """医員 id（文字列）→ 名前のマップ（キャッシュ済みの医員マスタから生成）"""
+    return {str(r.get("id", "")): r.get("name", "") for r in _cached_records("医員マスタ")}
+
+
 def add_doctor(name):
+    add_doctors([name])
+
+
+@_writes
+def add_doctors(names):
+    """医員をまとめて追加（登録済みの名前はスキップし、1回の append_rows で書き込む）"""
     ws = _get_sheet("医員マスタ")
-    # 重複チェック
     records = _get_all_records(ws)
-    if any(r["name"] == name for r in records):
-        return
-    new_id = _next_id(ws)
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    ws.append_row([new_id, name, "", "", 1, now])
+    existing = {r["name"] for r in records}
+    new_id = _next_id(records)
+    now = _now_str()
+    rows = []
+    for name in names:
+        if name in existing:
+            continue
+        existing.add(name)
+        rows.append([new_id, name, "", "", 1, now])
+        new_id += 1
+    if rows:
+        _retry(ws.append_rows, rows)
 
 
+@_writes
 def update_doctor(doc_id, name=None, is_active=None):
     ws = _get_sheet("医員マスタ")
-    row_idx = _find_row_index(ws, 1, doc_id)
+    row_idx = _find_row_index(ws, doc_id)
     if not row_idx:
         return
-    headers = ws.row_values(1)
+    fields = {}
     if name is not None:
-        col_idx = headers.index("name") + 1
-        ws.update_cell(row_idx, col_idx, name)
+        fields["name"] = name
     if is_active is not None:
-        col_idx = headers.index("is_active") + 1
-        ws.update_cell(row_idx, col_idx, int(is_active))
+        fields["is_active"] = int(is_active)
+    _apply_updates(ws, row_idx, fields)
 
 
+@_writes
 def delete_doctor(doc_id):
-    # 優先度マスタから削除
+    # 優先度マスタ・希望シート（全月）・医員マスタの A 列（doctor_id / id）を1回の batchGet で取得
+    sh = _get_spreadsheet()
     ws_aff = _get_sheet("優先度マスタ")
-    records = _get_all_records(ws_aff)
-    rows_to_delete = []
-    for i, r in enumerate(records):
-        if str(r.get("doctor_id", "")) == str(doc_id):
-            rows_to_delete.append(i + 2)  # +2: ヘッダー + 0-index
-    for row in sorted(rows_to_delete, reverse=True):
-        ws_aff.delete_rows(row)
+    ws_doc = _get_sheet("医員マスタ")
+    pref_sheets = [ws for ws in _list_worksheets() if ws.title.startswith("希望_")]
+    targets = [ws_aff] + pref_sheets + [ws_doc]
+    ranges = [absolute_range_name(ws.title, "A:A") for ws in targets]
+    value_ranges = _retry(sh.values_batch_get, ranges).get("valueRanges", [])
 
-    # 希望シートから削除（全月）
-    sh = _get_spreadsheet()
-    for ws in sh.worksheets():
-        if ws.title.startswith("希望_"):
-            recs = _get_all_records(ws)
-            for i, r in enumerate(recs):
-                if str(r.get("doctor_id", "")) == str(doc_id):
-                    ws.delete_rows(i + 2)
+    rows_to_delete = []
+    for ws, vr in zip(targets, value_ranges):
+        col = vr.get("values", [])
+        # 優先度マスタは該当行をすべて、希望シート・医員マスタは最初の1行のみ削除
+        delete_all = ws is ws_aff
+        for i, row in enumerate(col[1:]):  # ヘッダー行スキップ
+            if row and str(row[0]) == str(doc_id):
+                rows_to_delete.append((ws, i + 2))  # +2: ヘッダー + 0-index
+                if not delete_all:
                     break
 
-    # 医員マスタから削除
-    ws_doc = _get_sheet("医員マスタ")
-    row_idx = _find_row_index(ws_doc, 1, doc_id)
-    if row_idx:
-        ws_doc.delete_rows(row_idx)
+    _delete_rows_batch(rows_to_delete)
 
 
 # ---- Clinic CRUD ----
@@ -236,57 +378,74 @@ def get_clinics(active_only=True):
     return result
 
 
+def _clinic_name_map():
+    """外勤先 id（文字列）→ 名前のマップ（キャッシュ済みの外勤先マスタから生成）"""
+    return {str(r.get("id", "")): r.get("name", "") for r in _cached_records("外勤先マスタ")}
+
+
 def add_clinic(name, fee=0, frequency="weekly", preferred_doctors=None):
+    add_clinics([(name, fee, frequency, preferred_doctors)])
+
+
+@_writes
+def add_clinics(entries):
+    """外勤先をまとめて追加（entries: [(name, fee, frequency, preferred_doctors), ...]）
+
+    登録済みの名前はスキップし、1回の append_rows で書き込む
+    """
     ws = _get_sheet("外勤先マスタ")
     records = _get_all_records(ws)
-    if any(r["name"] == name for r in records):
-        return
-    new_id = _next_id(ws)
-    pref = json.dumps(preferred_doctors or [])
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    ws.append_row([new_id, name, fee, frequency, pref, 1, now])
+    existing = {r["name"] for r in records}
+    new_id = _next_id(records)
+    now = _now_str()
+    rows = []
+    for name, fee, frequency, preferred_doctors in entries:
+        if name in existing:
+            continue
+        existing.add(name)
+        rows.append([new_id, name, fee, frequency, _json_dumps(preferred_doctors or []), 1, now])
+        new_id += 1
+    if rows:
+        _retry(ws.append_rows, rows)
 
 
+@_writes
 def update_clinic(clinic_id, **kwargs):
     ws = _get_sheet("外勤先マスタ")
-    row_idx = _find_row_index(ws, 1, clinic_id)
+    row_idx = _find_row_index(ws, clinic_id)
     if not row_idx:
         return
-    headers = ws.row_values(1)
-    for key, val in kwargs.items():
-        if key == "preferred_doctors":
-            val = json.dumps(val)
-        if key in headers:
-            col_idx = headers.index(key) + 1
-            ws.update_cell(row_idx, col_idx, val)
+    fields = dict(kwargs)
+    if "preferred_doctors" in fields:
+        fields["preferred_doctors"] = _json_dumps(fields["preferred_doctors"])
+    _apply_updates(ws, row_idx, fields)
 
 
+@_writes
 def delete_clinic(clinic_id):
+    rows_to_delete = []
+
     # 優先度マスタから削除
     ws_aff = _get_sheet("優先度マスタ")
     records = _get_all_records(ws_aff)
-    rows_to_delete = []
     for i, r in enumerate(records):
         if str(r.get("clinic_id", "")) == str(clinic_id):
-            rows_to_delete.append(i + 2)
-    for row in sorted(rows_to_delete, reverse=True):
-        ws_aff.delete_rows(row)
+            rows_to_delete.append((ws_aff, i + 2))
 
     # 日別設定から削除
     ws_ovr = _get_sheet("日別設定")
     records = _get_all_records(ws_ovr)
-    rows_to_delete = []
     for i, r in enumerate(records):
         if str(r.get("clinic_id", "")) == str(clinic_id):
-            rows_to_delete.append(i + 2)
-    for row in sorted(rows_to_delete, reverse=True):
-        ws_ovr.delete_rows(row)
+            rows_to_delete.append((ws_ovr, i + 2))
 
     # 外勤先マスタから削除
     ws_cli = _get_sheet("外勤先マスタ")
-    row_idx = _find_row_index(ws_cli, 1, clinic_id)
+    row_idx = _find_row_index(ws_cli, clinic_id)
     if row_idx:
-        ws_cli.delete_rows(row_idx)
+        rows_to_delete.append((ws_cli, row_idx))
+
+    _delete_rows_batch(rows_to_delete)
 
 
 # ---- Preferences ----
@@ -324,23 +483,22 @@ def get_all_preferences(year_month):
     return result
 
 
+@_writes
 def upsert_preference(doctor_id, year_month, ng_dates=None, avoid_dates=None, preferred_clinics=None):
     ws = _get_pref_sheet(year_month)
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    ng = json.dumps(ng_dates or [])
-    av = json.dumps(avoid_dates or [])
-    pc = json.dumps(preferred_clinics or [])
-
-    # 医員名を取得
-    doctors = get_doctors(active_only=False)
-    doc_name = ""
-    for d in doctors:
-        if d["id"] == doctor_id:
-            doc_name = d["name"]
-            break
+    now = _now_str()
+    ng = _json_dumps(ng_dates or [])
+    av = _json_dumps(avoid_dates or [])
+    pc = _json_dumps(preferred_clinics or [])
 
-    # 既存行を探す
-    row_idx = _find_row_index(ws, 1, doctor_id)
+    doc_name = _doctor_name_map().get(str(doctor_id), "")
+
+    # 既存行を探す（キャッシュ済みレコードから行番号を解決）
+    row_idx = None
+    for i, r in enumerate(_get_all_records(ws)):
+        if str(r.get("doctor_id", "")) == str(doctor_id):
+            row_idx = i + 2  # +2: ヘッダー + 0-index
+            break
     if row_idx:
         ws.update([[str(doctor_id), doc_name, ng, av, pc, now]], f"A{row_idx}")
     else:
@@ -350,29 +508,56 @@ def upsert_preference(doctor_id, year_month, ng_dates=None, avoid_dates=None, pr
 # ---- Affinity ----
 
 def get_affinities():
-    ws = _get_sheet("優先度マスタ")
-    records = _get_all_records(ws)
-    doctors = {d["id"]: d["name"] for d in get_doctors(active_only=False)}
-    clinics = {c["id"]: c["name"] for c in get_clinics(active_only=False)}
-    result = []
-    for r in records:
-        r["doctor_id"] = int(r["doctor_id"])
-        r["clinic_id"] = int(r["clinic_id"])
-        r["weight"] = float(r.get("weight", 1.0))
-        r["doctor_name"] = doctors.get(r["doctor_id"], "")
-        r["clinic_name"] = clinics.get(r["clinic_id"], "")
-        result.append(r)
-    return result
+    doc_names = _doctor_name_map()
+    clinic_names = _clinic_name_map()
+    return [
+        {
+            "doctor_id": int(r["doctor_id"]),
+            "clinic_id": int(r["clinic_id"]),
+            "weight": float(r.get("weight", 1.0)),
+            "doctor_name": doc_names.get(str(r["doctor_id"]), ""),
+            "clinic_name": clinic_names.get(str(r["clinic_id"]), ""),
+        }
+        for r in _cached_records("優先度マスタ")
+    ]
 
 
 def set_affinity(doctor_id, clinic_id, weight):
+    set_affinities([(doctor_id, clinic_id, weight)])
+
+
+def set_affinities(entries):
+    """優先度をまとめて設定（変更がなければ何もしない）"""
+    entries = list(entries)
+    if entries:
+        _set_affinities(entries)
+
+
+@_writes
+def _set_affinities(entries):
+    """優先度をまとめて書き込む（entries: [(doctor_id, clinic_id, weight), ...]）
+
+    既存行の更新は1回の batch_update、新規行は1回の append_rows で書き込む
+    """
     ws = _get_sheet("優先度マスタ")
     records = _get_all_records(ws)
-    for i, r in enumerate(records):
-        if str(r.get("doctor_id", "")) == str(doctor_id) and str(r.get("clinic_id", "")) == str(clinic_id):
-            ws.update([[str(doctor_id), str(clinic_id), weight]], f"A{i+2}")
-            return
-    ws.append_row([str(doctor_id), str(clinic_id), weight])
+    row_map = {
+        (str(r.get("doctor_id", "")), str(r.get("clinic_id", ""))): i + 2
+        for i, r in enumerate(records)
+    }
+    updates = []
+    additions = []
+    for doctor_id, clinic_id, weight in entries:
+        row = [str(doctor_id), str(clinic_id), weight]
+        row_idx = row_map.get((str(doctor_id), str(clinic_id)))
+        if row_idx:
+            updates.append({"range": f"A{row_idx}", "values": [row]})
+        else:
+            additions.append(row)
+    if updates:
+        _retry(ws.batch_update, updates)
+    if additions:
+        _retry(ws.append_rows, additions)
 
 
 # ---- Schedules ----
@@ -384,22 +569,28 @@ def _get_sched_sheet(year_month):
     return _init_monthly_sheet(name, headers)
 
 
+@_writes
 def save_schedule(year_month, plan_name, assignments, total_variance=0, satisfaction_score=0):
     ws = _get_sched_sheet(year_month)
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    records = _get_all_records(ws)
+    now = _now_str()
+    # 割り当て JSON を含む全行は読まず、id・plan_name 列（A:B）だけを取得
+    id_names = _retry(ws.batch_get, ["A2:B"])[0]
+    records = [
+        {"id": row[0] if row else "", "plan_name": row[1] if len(row) > 1 else ""}
+        for row in id_names
+    ]
 
     # 同名プランがあれば更新
     for i, r in enumerate(records):
-        if r.get("plan_name") == plan_name:
+        if r["plan_name"] == plan_name:
             ws.update([[
-                str(r["id"]), plan_name, json.dumps(assignments),
+                str(r["id"]), plan_name, _json_dumps(assignments),
                 total_variance, satisfaction_score, 0, now
             ]], f"A{i+2}")
             return
 
-    new_id = _next_id(ws)
-    ws.append_row([new_id, plan_name, json.dumps(assignments), total_variance, satisfaction_score, 0, now])
+    new_id = _next_id(records)
+    ws.append_row([new_id, plan_name, _json_dumps(assignments), total_variance, satisfaction_score, 0, now])
 
 
 def get_schedules(year_month):
@@ -417,26 +608,25 @@ def get_schedules(year_month):
     return result
 
 
+@_writes
 def confirm_schedule(schedule_id):
     # 現在のシートを特定する必要がある → 全スケジュールシートを走査
-    sh = _get_spreadsheet()
-    for ws in sh.worksheets():
+    for ws in _list_worksheets():
         if not ws.title.startswith("スケジュール_"):
             continue
         records = _get_all_records(ws)
         for i, r in enumerate(records):
             if str(r.get("id", "")) == str(schedule_id):
-                # 同月の全プランを未確定にリセット
-                for j in range(len(records)):
-                    ws.update_cell(j + 2, 6, 0)
-                # 対象プランを確定
-                ws.update_cell(i + 2, 6, 1)
+                # 同月の全プランを未確定にリセットし、対象プランのみ確定（F列を1回で更新）
+                flags = [[1 if j == i else 0] for j in range(len(records))]
+                _retry(ws.batch_update, [{"range": f"F2:F{len(records) + 1}", "values": flags}],
+                       value_input_option=ValueInputOption.user_entered)
                 return
 
 
+@_writes
 def delete_schedule(schedule_id):
-    sh = _get_spreadsheet()
-    for ws in sh.worksheets():
+    for ws in _list_worksheets():
         if not ws.title.startswith("スケジュール_"):
             continue
         records = _get_all_records(ws)
@@ -446,29 +636,32 @@ def delete_schedule(schedule_id):
                 return
 
 
+@_writes
 def update_schedule_assignments(schedule_id, assignments):
-    sh = _get_spreadsheet()
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    for ws in sh.worksheets():
+    now = _now_str()
+    for ws in _list_worksheets():
         if not ws.title.startswith("スケジュール_"):
             continue
         records = _get_all_records(ws)
         for i, r in enumerate(records):
             if str(r.get("id", "")) == str(schedule_id):
-                ws.update_cell(i + 2, 3, json.dumps(assignments))
-                ws.update_cell(i + 2, 7, now)
+                _apply_updates(ws, i + 2, {"assignments": _json_dumps(assignments), "created_at": now})
                 return
 
 
 def get_all_confirmed_schedules():
     """全月の確定スケジュールを取得（累計報酬計算用）"""
-    sh = _get_spreadsheet()
+    titles = tuple(ws.title for ws in _list_worksheets() if ws.title.startswith("スケジュール_"))
+    try:
+        batch = _cached_batch_records(titles)
+    except gspread.exceptions.APIError:
+        # 一覧取得後に他プロセスで削除されたシートが含まれる場合は、一覧を取り直して1回だけ再試行
+        _invalidate_worksheet_list()
+        titles = tuple(ws.title for ws in _list_worksheets() if ws.title.startswith("スケジュール_"))
+        batch = _cached_batch_records(titles)
     result = []
-    for ws in sh.worksheets():
-        if not ws.title.startswith("スケジュール_"):
-            continue
-        year_month = ws.title.replace("スケジュール_", "")
-        records = _get_all_records(ws)
+    for title, records in batch.items():
+        year_month = title.replace("スケジュール_", "")
         for r in records:
             if int(r.get("is_confirmed", 0)):
                 r["id"] = int(r["id"])
@@ -481,8 +674,30 @@ def get_all_confirmed_schedules():
 
 # ---- Settings / Auth ----
 
-def _hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode()).hexdigest()
+_PBKDF2_PREFIX = "pbkdf2_sha256"
+_PBKDF2_ITERATIONS = 100_000
+
+
+def _hash_password(password: str, salt: bytes = None, iterations: int = _PBKDF2_ITERATIONS) -> str:
+    """ソルト付き PBKDF2-SHA256 でハッシュ化（"pbkdf2_sha256$回数$ソルト$ハッシュ" 形式）"""
+    if salt is None:
+        salt = os.urandom(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+    return f"{_PBKDF2_PREFIX}${iterations}${salt.hex()}${digest.hex()}"
+
+
+def _password_matches(stored: str, password: str) -> bool:
+    """保存済みハッシュと入力パスワードを定数時間で比較（旧形式の SHA-256 ハッシュにも対応）"""
+    stored = str(stored)
+    parts = stored.split("$")
+    if len(parts) == 4 and parts[0] == _PBKDF2_PREFIX:
+        try:
+            expected = _hash_password(password, bytes.fromhex(parts[2]), int(parts[1]))
+        except ValueError:
+            return False
+    else:
+        expected = hashlib.sha256(password.encode()).hexdigest()
+    return hmac.compare_digest(stored.encode(), expected.encode())
 
 
 def _get_setting(key):
@@ -494,11 +709,12 @@ def _get_setting(key):
     return None
 
 
+@_writes
 def _set_setting(key, value):
     ws = _get_sheet("設定")
-    row_idx = _find_row_index(ws, 1, key)
+    row_idx = _find_row_index(ws, key)
     if row_idx:
-        ws.update_cell(row_idx, 2, value)
+        _apply_updates(ws, row_idx, {"value": value})
     else:
         ws.append_row([key, value])
 
@@ -515,109 +731,140 @@ def verify_admin_password(password: str) -> bool:
     stored = _get_setting("admin_password")
     if not stored:
         return False
-    return stored == _hash_password(password)
+    return _password_matches(stored, password)
+
+
+def _get_doctor_by_id(doctor_id):
+    """医員マスタのレコードを id で取得（キャッシュ済みレコードから検索）"""
+    for r in _cached_records("医員マスタ"):
+        if str(r.get("id", "")) == str(doctor_id):
+            return r
+    return None
 
 
 def is_doctor_individual_password_set(doctor_id) -> bool:
     """医員の個別パスワードが設定済みか"""
-    ws = _get_sheet("医員マスタ")
-    row_idx = _find_row_index(ws, 1, doctor_id)
-    if not row_idx:
-        return False
-    headers = ws.row_values(1)
-    if "password_hash" not in headers:
-        return False
-    col_idx = headers.index("password_hash") + 1
-    val = ws.cell(row_idx, col_idx).value
-    return bool(val)
+    rec = _get_doctor_by_id(doctor_id)
+    return bool(rec and rec.get("password_hash"))
 
 
+@_writes
 def set_doctor_individual_password(doctor_id, password: str):
     """医員の個別パスワードを設定"""
     ws = _get_sheet("医員マスタ")
-    row_idx = _find_row_index(ws, 1, doctor_id)
+    row_idx = _find_row_index(ws, doctor_id)
     if not row_idx:
         return
-    headers = ws.row_values(1)
-    col_idx = headers.index("password_hash") + 1
-    ws.update_cell(row_idx, col_idx, _hash_password(password))
+    _apply_updates(ws, row_idx, {"password_hash": _hash_password(password)})
 
 
 def verify_doctor_individual_password(doctor_id, password: str) -> bool:
     """医員の個別パスワードを検証"""
-    ws = _get_sheet("医員マスタ")
-    row_idx = _find_row_index(ws, 1, doctor_id)
-    if not row_idx:
-        return False
-    headers = ws.row_values(1)
-    if "password_hash" not in headers:
-        return False
-    col_idx = headers.index("password_hash") + 1
-    stored = ws.cell(row_idx, col_idx).value
+    rec = _get_doctor_by_id(doctor_id)
+    stored = rec.get("password_hash") if rec else None
     if not stored:
         return False
-    return stored == _hash_password(password)
+    return _password_matches(stored, password)
 
 
+@_writes
 def update_doctor_email(doctor_id, email: str):
     """医員のメールアドレスを設定/更新"""
     ws = _get_sheet("医員マスタ")
-    row_idx = _find_row_index(ws, 1, doctor_id)
+    row_idx = _find_row_index(ws, doctor_id)
     if not row_idx:
         return
-    headers = ws.row_values(1)
-    col_idx = headers.index("email") + 1
-    ws.update_cell(row_idx, col_idx, email)
+    _apply_updates(ws, row_idx, {"email": email})
 
 
 # ---- Clinic Date Overrides ----
 
 def get_clinic_date_overrides(year_month):
     """指定月のオーバーライドを {(clinic_id, date_str): required_doctors} で返す"""
-    ws = _get_sheet("日別設定")
-    records = _get_all_records(ws)
-    result = {}
-    for r in records:
-        d = str(r.get("date", ""))
-        if d.startswith(year_month):
-            result[(int(r["clinic_id"]), d)] = int(r["required_doctors"])
-    return result
+    return _cached_overrides_by_month().get(year_month, {})
+
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _cached_overrides_by_month():
+    """日別設定を1回の走査で月ごとに振り分け {year_month: {(clinic_id, date_str): required_doctors}}"""
+    by_month = {}
+    for r in _cached_records("日別設定"):
+        d = str(r.get("date", "")).strip()
+        cid = str(r.get("clinic_id", "")).strip()
+        if not d or not cid:
+            continue  # シート上で手動クリアされた空行など
+        try:
+            datetime.strptime(d, "%Y-%m-%d")
+            key = (int(cid), d)
+            required = int(r["required_doctors"])
+        except (KeyError, ValueError):
+            continue  # 形式が不正な行は他の行・他の月に影響させずに読み飛ばす
+        by_month.setdefault(d[:7], {})[key] = required
+    return by_month
 
 
 def set_clinic_date_override(clinic_id, date_str, required_doctors):
-    ws = _get_sheet("日別設定")
-    records = _get_all_records(ws)
-
-    # 既存行を探す
-    for i, r in enumerate(records):
-        if str(r.get("clinic_id", "")) == str(clinic_id) and str(r.get("date", "")) == date_str:
-            if required_doctors == 1:
-                ws.delete_rows(i + 2)
-            else:
-                ws.update([[str(clinic_id), date_str, required_doctors]], f"A{i+2}")
-            return
+    set_clinic_date_overrides({(clinic_id, date_str): required_doctors})
 
-    # 新規（通常=1以外のみ保存）
-    if required_doctors != 1:
-        ws.append_row([str(clinic_id), date_str, required_doctors])
 
+def set_clinic_date_overrides(changes):
+    """日別設定をまとめて保存（変更がなければ何もしない）"""
+    changes = dict(changes)
+    if changes:
+        _set_clinic_date_overrides(changes)
 
-_old_schedules_cleaned = False
 
+@_writes
+def _set_clinic_date_overrides(changes):
+    """日別設定をまとめて書き込む（changes: {(clinic_id, date_str): required_doctors}）
 
+    通常(1人)に戻した行は削除、既存行は更新、それ以外は追加。種類ごとに1回の API 呼び出しで書き込む
+    """
+    ws = _get_sheet("日別設定")
+    records = _get_all_records(ws)
+    row_map = {
+        (str(r.get("clinic_id", "")), str(r.get("date", ""))): i + 2
+        for i, r in enumerate(records)
+    }
+    updates = []
+    additions = []
+    rows_to_delete = []
+    for (clinic_id, date_str), required_doctors in changes.items():
+        row_idx = row_map.get((str(clinic_id), date_str))
+        if row_idx:
+            if required_doctors == 1:
+                rows_to_delete.append((ws, row_idx))
+            else:
+                updates.append({
+                    "range": f"A{row_idx}",
+                    "values": [[str(clinic_id), date_str, required_doctors]],
+                })
+        # 新規（通常=1以外のみ保存）
+        elif required_doctors != 1:
+            additions.append([str(clinic_id), date_str, required_doctors])
+
+    # 行削除で行番号がずれる前に更新を書き込む
+    if updates:
+        _retry(ws.batch_update, updates)
+    _delete_rows_batch(rows_to_delete)
+    if additions:
+        _retry(ws.append_rows, additions)
+
+
+@_writes
 def delete_old_schedules(months_to_keep=4):
-    """古い月別シートを削除（プロセス中1回のみ、キャッシュ利用）"""
-    global _old_schedules_cleaned
-    if _old_schedules_cleaned:
-        return
-    _old_schedules_cleaned = True
+    """古い月別シートを削除（呼び出し頻度は app.py 側のキャッシュで制御）"""
     from dateutil.relativedelta import relativedelta
     cutoff = (datetime.now() - relativedelta(months=months_to_keep)).strftime("%Y-%m")
-    sh = _get_spreadsheet()
-    for name, ws in list(_ws_cache.items()):
+    expired = []
+    for ws in _list_worksheets():
+        name = ws.title
         for prefix in ("希望_", "スケジュール_"):
             if name.startswith(prefix):
                 ym = name.replace(prefix, "")
                 if ym < cutoff:
-                    sh.del_worksheet(ws)
+                    expired.append(ws)
                     _ws_cache.pop(name, None)
+    if expired:
+        requests = [{"deleteSheet": {"sheetId": ws.id}} for ws in expired]
+        _retry(_get_spreadsheet().batch_update, {"requests": requests})
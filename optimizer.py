@@ -2,7 +2,14 @@
 スケジューリング最適化モジュール
 PuLPを使用した制約付き最適化で外勤割り当てを生成
 """
+import copy
+import functools
+import hashlib
 import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, timedelta
 import jpholiday
 import pulp
@@ -15,14 +22,22 @@ PRIORITY_POSSIBLE = 1.0  # ○ 行くときもある
 PRIORITY_NEVER = 0.0     # × まったく行かない
 
 
+@functools.lru_cache(maxsize=1024)
+def _is_holiday(d: date) -> bool:
+    """祝日判定（同じ日付の判定結果は再利用）"""
+    return jpholiday.is_holiday(d)
+
+
 def get_target_saturdays(year: int, month: int) -> list[date]:
     """指定月の土曜日を取得（祝日除外）"""
     saturdays = []
-    d = date(year, month, 1)
+    first = date(year, month, 1)
+    # 最初の土曜日から7日刻みで走査（祝日判定は土曜日の4〜5回のみ）
+    d = first + timedelta(days=(5 - first.weekday()) % 7)
     while d.month == month:
-        if d.weekday() == 5 and not jpholiday.is_holiday(d):
+        if not _is_holiday(d):
             saturdays.append(d)
-        d += timedelta(days=1)
+        d += timedelta(days=7)
     return saturdays
 
 
@@ -43,6 +58,58 @@ def get_clinic_dates(clinic: dict, saturdays: list[date]) -> list[date]:
         return saturdays
 
 
+# 使用するソルバー（既定は CBC。環境変数 GAIKIN_SOLVER=HiGHS で HiGHS を使う。highspy が必要）
+SOLVER_TIME_LIMIT = 30
+
+
+def _highs_selected():
+    """GAIKIN_SOLVER で HiGHS が指定され、かつ highspy が利用可能か"""
+    if os.environ.get("GAIKIN_SOLVER", "").upper() != "HIGHS":
+        return False
+    highs = getattr(pulp, "HiGHS", None)  # PuLP 2.8 未満には HiGHS（highspy）クラスがない
+    return highs is not None and highs(msg=False).available()
+
+
+def _get_solver(warm_start=False):
+    """使用するソルバーを返す
+
+    warm_start: 変数の初期値を暫定解として渡す（CBC のみ対応）
+    """
+    if _highs_selected():
+        return pulp.HiGHS(msg=False, timeLimit=SOLVER_TIME_LIMIT)
+    return pulp.PULP_CBC_CMD(msg=0, timeLimit=SOLVER_TIME_LIMIT, warmStart=warm_start)
+
+
+# 求解結果のキャッシュ（入力内容のハッシュ → 結果）
+_SOLVE_CACHE_SIZE = 32
+_solve_cache = OrderedDict()
+_solve_cache_lock = threading.Lock()
+
+
+def _solve_key(doctors, clinics, saturdays, preferences, affinities,
+               mode, previous_earnings, date_overrides) -> str:
+    """ソルバーの入力のうち結果に影響する項目だけを正規化してハッシュ化"""
+    payload = [
+        [d["id"] for d in doctors],
+        [
+            [c["id"], c.get("fee", 0), c.get("frequency", "weekly"), c.get("preferred_doctors", [])]
+            for c in clinics
+        ],
+        [s.isoformat() for s in saturdays],
+        [
+            [p["doctor_id"], sorted(p.get("ng_dates", [])), sorted(p.get("avoid_dates", [])),
+             sorted(p.get("preferred_clinics", []))]
+            for p in preferences
+        ],
+        [[a["doctor_id"], a["clinic_id"], a["weight"]] for a in affinities],
+        mode,
+        sorted((previous_earnings or {}).items()),
+        sorted([cid, ds, req] for (cid, ds), req in (date_overrides or {}).items()),
+    ]
+    raw = json.dumps(payload, separators=(",", ":"), default=str).encode()
+    return hashlib.blake2b(raw, digest_size=16, usedforsecurity=False).hexdigest()
+
+
 def solve_schedule(
     doctors: list[dict],
     clinics: list[dict],
@@ -52,6 +119,42 @@ def solve_schedule(
     mode: str = "balanced",
     previous_earnings: dict = None,
     date_overrides: dict = None,
+    warm_start: list[dict] = None,
+) -> dict | None:
+    """最適化ソルバー（同一入力の結果はキャッシュから返す）
+
+    warm_start: 同じ制約で得た割り当て（別モードの解など）。CBC 使用時に初期解として渡し探索を短縮する
+    """
+    key = _solve_key(doctors, clinics, saturdays, preferences, affinities,
+                     mode, previous_earnings, date_overrides)
+    with _solve_cache_lock:
+        if key in _solve_cache:
+            _solve_cache.move_to_end(key)
+            # 呼び出し側で結果に項目を追加するため、キャッシュ本体はコピーして返す
+            return copy.deepcopy(_solve_cache[key])
+
+    result = _solve_schedule(
+        doctors, clinics, saturdays, preferences, affinities,
+        mode=mode, previous_earnings=previous_earnings,
+        date_overrides=date_overrides, warm_start=warm_start,
+    )
+    with _solve_cache_lock:
+        _solve_cache[key] = result
+        if len(_solve_cache) > _SOLVE_CACHE_SIZE:
+            _solve_cache.popitem(last=False)
+    return copy.deepcopy(result)
+
+
+def _solve_schedule(
+    doctors: list[dict],
+    clinics: list[dict],
+    saturdays: list[date],
+    preferences: list[dict],
+    affinities: list[dict],
+    mode: str = "balanced",
+    previous_earnings: dict = None,
+    date_overrides: dict = None,
+    warm_start: list[dict] = None,
 ) -> dict | None:
     """
     最適化ソルバー
@@ -67,24 +170,30 @@ def solve_schedule(
     # 日別オーバーライド: {(clinic_id, date_str): required_doctors}
     overrides = date_overrides or {}
 
-    # 各外勤先の対象日（休診=0 を除外）
-    clinic_dates = {}
-    slot_required = {}  # スロットごとの必要医員数
+    # 各外勤先の対象日（休診=0 を除外）と、スロットごとの必要医員数
+    sat_isos = {s: s.isoformat() for s in saturdays}
+    slot_required = {}
     for c in clinic_list:
-        cd = get_clinic_dates(c, saturdays)
-        for d in cd:
-            ds = d.isoformat()
+        for d in get_clinic_dates(c, saturdays):
+            ds = sat_isos[d]
             req = overrides.get((c["id"], ds), 1)
             if req == 0:
                 continue  # 休診: スロットを生成しない
-            clinic_dates[(c["id"], ds)] = True
             slot_required[(c["id"], ds)] = req
 
     # 全スロット: (clinic_id, date_str)
-    slots = list(clinic_dates.keys())
+    slots = list(slot_required)
     if not slots:
         return None
 
+    # スロットの外勤先IDの配列と、日付別・外勤先別のスロット（医員に依存しないので1回だけ作る）
+    slot_cids = np.fromiter((cid for cid, _ in slots), dtype=np.int64, count=len(slots))
+    slots_by_date = {}
+    slots_by_clinic = {}
+    for (cid, ds) in slots:
+        slots_by_date.setdefault(ds, []).append((cid, ds))
+        slots_by_clinic.setdefault(cid, []).append((cid, ds))
+
     # NG日・△日マップ
     ng_map = {}
     avoid_map = {}
@@ -94,13 +203,8 @@ def solve_schedule(
         avoid_map[p["doctor_id"]] = set(p.get("avoid_dates", []))
         pref_clinics_map[p["doctor_id"]] = set(p.get("preferred_clinics", []))
 
-    # 外勤先の希望医員マップ
-    clinic_preferred = {}
-    for c in clinic_list:
-        pref = c.get("preferred_doctors", "[]")
-        if isinstance(pref, str):
-            pref = json.loads(pref)
-        clinic_preferred[c["id"]] = set(pref)
+    # 外勤先の希望医員マップ（preferred_doctors は get_clinics でデコード済みのリスト）
+    clinic_preferred = {c["id"]: set(c.get("preferred_doctors", [])) for c in clinic_list}
 
     # 優先度マップ (weight: ◎=2.0, ○=1.0, ×=0.0)
     priority_map = {}
@@ -122,12 +226,36 @@ def solve_schedule(
     # ---- PuLP モデル ----
     prob = pulp.LpProblem("GaikinSchedule", pulp.LpMinimize)
 
+    # 日付ごとのビット（対象月の土曜日は高々5日）で NG日・△日をビットマスク化し、
+    # 医員 × スロットの該当判定をビット AND 1回でまとめて行う
+    date_to_bit = {ds: 1 << k for k, ds in enumerate(sorted(slots_by_date))}
+    slot_bits = np.fromiter((date_to_bit[ds] for _, ds in slots), dtype=np.uint32, count=len(slots))
+
+    def _date_mask(date_map):
+        mask = np.zeros(len(doc_ids), dtype=np.uint32)
+        for i, doc_id in enumerate(doc_ids):
+            for ds in date_map.get(doc_id, ()):
+                mask[i] |= date_to_bit.get(ds, 0)
+        return (mask[:, None] & slot_bits[None, :]) != 0
+
+    ng_hit = _date_mask(ng_map)
+    avoid_hit = _date_mask(avoid_map)
+
+    # 割り当て可否マスク（医員 × スロット）: ×日（NG）・×外勤先（never）は不可
+    allowed = ~ng_hit
+    for i, doc_id in enumerate(doc_ids):
+        never_cids = never_pairs.get(doc_id)
+        if never_cids:
+            allowed[i] &= ~np.isin(slot_cids, never_cids)
+
     # 決定変数: x[doc_id, clinic_id, date_str] ∈ {0,1}
+    # 割り当て不可の組は上限0で固定し、個別の等式制約を作らない
     x = {}
-    for doc_id in doc_ids:
-        for (cid, ds) in slots:
+    for i, doc_id in enumerate(doc_ids):
+        for j, (cid, ds) in enumerate(slots):
             x[(doc_id, cid, ds)] = pulp.LpVariable(
-                f"x_{doc_id}_{cid}_{ds}", cat=pulp.LpBinary
+                f"x_{doc_id}_{cid}_{ds}", lowBound=0, upBound=int(allowed[i, j]),
+                cat=pulp.LpInteger,
             )
 
     # ---- 制約条件 ----
@@ -141,34 +269,19 @@ def solve_schedule(
         )
 
     # 2. 各医員は同一日に最大1外勤
-    all_dates = sorted(set(ds for _, ds in slots))
     for doc_id in doc_ids:
-        for ds in all_dates:
-            relevant = [(cid, ds2) for (cid, ds2) in slots if ds2 == ds]
-            if relevant:
-                prob += (
-                    pulp.lpSum(x[(doc_id, cid, ds2)] for (cid, ds2) in relevant) <= 1,
-                    f"one_per_day_{doc_id}_{ds}"
-                )
+        for ds in sorted(slots_by_date):
+            prob += (
+                pulp.lpSum(x[(doc_id, cid, ds2)] for (cid, ds2) in slots_by_date[ds]) <= 1,
+                f"one_per_day_{doc_id}_{ds}"
+            )
 
-    # 3. ×日（NG）は割り当て不可
-    for doc_id in doc_ids:
-        ng_dates = ng_map.get(doc_id, set())
-        for (cid, ds) in slots:
-            if ds in ng_dates:
-                prob += x[(doc_id, cid, ds)] == 0, f"ng_{doc_id}_{cid}_{ds}"
-
-    # 4. ×外勤先（never）は割り当て不可
-    for doc_id in doc_ids:
-        for cid in never_pairs.get(doc_id, []):
-            for (slot_cid, ds) in slots:
-                if slot_cid == cid:
-                    prob += x[(doc_id, cid, ds)] == 0, f"never_{doc_id}_{cid}_{ds}"
+    # 3. ×日（NG）・4. ×外勤先（never）は割り当て不可 → 決定変数の上限0で表現済み
 
     # 5. ◎外勤先（must）は月1回以上割り当て
     for doc_id in doc_ids:
         for cid in must_pairs.get(doc_id, []):
-            clinic_slots = [(c, d) for (c, d) in slots if c == cid]
+            clinic_slots = slots_by_clinic.get(cid)
             if clinic_slots:
                 prob += (
                     pulp.lpSum(x[(doc_id, c, d)] for (c, d) in clinic_slots) >= 1,
@@ -205,36 +318,22 @@ def solve_schedule(
 
     variance_term = pulp.lpSum(dev_plus[d] + dev_minus[d] for d in doc_ids)
 
-    # 希望スコア（医員が希望した外勤先に行けるとプラス）
-    preference_term = pulp.lpSum(
-        x[(doc_id, cid, ds)]
-        for doc_id in doc_ids
-        for (cid, ds) in slots
-        if cid in pref_clinics_map.get(doc_id, set())
-    )
-
-    # 指名スコア（外勤先が指名した医員に来てもらえるとプラス）
-    nomination_term = pulp.lpSum(
-        x[(doc_id, cid, ds)]
-        for doc_id in doc_ids
-        for (cid, ds) in slots
-        if doc_id in clinic_preferred.get(cid, set())
-    )
-
-    # 優先度スコア（◎=2, ○=1 の外勤先に行くとプラス）
-    priority_term = pulp.lpSum(
-        x[(doc_id, cid, ds)] * priority_map.get((doc_id, cid), 0)
-        for doc_id in doc_ids
-        for (cid, ds) in slots
-    )
-
-    # △日ペナルティ（できれば避けたい日に割り当てるとペナルティ）
-    avoid_penalty = pulp.lpSum(
-        x[(doc_id, cid, ds)]
-        for doc_id in doc_ids
-        for (cid, ds) in slots
-        if ds in avoid_map.get(doc_id, set())
-    )
+    # 医員 × スロットごとの評価（希望・指名・優先度）を1回の走査で行列化
+    #   pref_hit:  医員が希望した外勤先に行けるとプラス
+    #   nom_hit:   外勤先が指名した医員に来てもらえるとプラス
+    #   pri_weight: ◎=2, ○=1 の外勤先に行くとプラス
+    #   avoid_hit: △日（できれば避けたい日）に割り当てるとペナルティ（ビットマスクで算出済み）
+    pref_hit = np.zeros((n_docs, len(slots)))
+    nom_hit = np.zeros((n_docs, len(slots)))
+    pri_weight = np.zeros((n_docs, len(slots)))
+    for i, doc_id in enumerate(doc_ids):
+        pref_cids = pref_clinics_map.get(doc_id, set())
+        for j, (cid, _) in enumerate(slots):
+            if cid in pref_cids:
+                pref_hit[i, j] = 1
+            if doc_id in clinic_preferred.get(cid, set()):
+                nom_hit[i, j] = 1
+            pri_weight[i, j] = priority_map.get((doc_id, cid), 0)
 
     # 回数の均等性（各医員の総外勤回数のばらつき）
     count_per_doc = {}
@@ -271,60 +370,63 @@ def solve_schedule(
     if all(fee_map.get(cid, 0) == 0 for cid in fee_map):
         w_var = 0
 
+    # 希望・指名・優先度・△日の4項を1つの係数行列にまとめ、割り当て変数の1次式を1回で作る
+    coef = w_pref * pref_hit + w_nom * nom_hit + w_pri * pri_weight + w_avoid * avoid_hit
+    assignment_term = pulp.LpAffineExpression([
+        (x[(doc_id, cid, ds)], float(coef[i, j]))
+        for i, doc_id in enumerate(doc_ids)
+        for j, (cid, ds) in enumerate(slots)
+        if coef[i, j] != 0
+    ])
+
     prob += (
         w_var * variance_term
-        + w_pref * preference_term
-        + w_nom * nomination_term
-        + w_pri * priority_term
-        + w_avoid * avoid_penalty
+        + assignment_term
         + w_cnt * count_variance
     )
 
     # ---- 求解 ----
-    solver = pulp.PULP_CBC_CMD(msg=0, timeLimit=30)
-    status = prob.solve(solver)
+    # 初期解（他モードの割り当て）があれば変数の初期値として設定（初期解を使えるのは CBC のみ）
+    use_warm_start = bool(warm_start) and not _highs_selected()
+    if use_warm_start:
+        assigned = {(a["doctor_id"], a["clinic_id"], a["date"]) for a in warm_start}
+        for k, var in x.items():
+            var.setInitialValue(1 if k in assigned else 0)
+
+    status = prob.solve(_get_solver(warm_start=use_warm_start))
 
     if pulp.LpStatus[status] != "Optimal":
         return None
 
     # ---- 結果抽出 ----
-    assignments = []
-    for (cid, ds) in slots:
-        for doc_id in doc_ids:
-            if pulp.value(x[(doc_id, cid, ds)]) > 0.5:
-                assignments.append({
-                    "date": ds,
-                    "clinic_id": cid,
-                    "doctor_id": doc_id,
-                })
-
-    # 統計
-    doc_earnings = {d: 0 for d in doc_ids}
-    doc_counts = {d: 0 for d in doc_ids}
-    for a in assignments:
-        doc_earnings[a["doctor_id"]] += fee_map.get(a["clinic_id"], 0)
-        doc_counts[a["doctor_id"]] += 1
-
-    earnings_list = list(doc_earnings.values())
-    total_var = float(np.std(earnings_list)) if earnings_list else 0
-
-    # 満足度スコア
-    sat = 0
-    for a in assignments:
-        did, cid = a["doctor_id"], a["clinic_id"]
-        if cid in pref_clinics_map.get(did, set()):
-            sat += 1
-        if did in clinic_preferred.get(cid, set()):
-            sat += 1
-        sat += priority_map.get((did, cid), 0)
+    # 解を 医員 × スロット の 0/1 行列として読み出し、報酬・回数・満足度は行列演算で集計
+    solved = np.array([
+        [(x[(doc_id, cid, ds)].varValue or 0) > 0.5 for (cid, ds) in slots]
+        for doc_id in doc_ids
+    ])
+    assignments = [
+        {"date": slots[j][1], "clinic_id": slots[j][0], "doctor_id": doc_ids[i]}
+        for j, i in np.argwhere(solved.T)  # スロット順 → 医員順
+    ]
+
+    slot_fees = np.fromiter((fee_map.get(cid, 0) for cid, _ in slots), dtype=np.int64, count=len(slots))
+    earnings_arr = solved.astype(np.int64) @ slot_fees
+    counts_arr = solved.sum(axis=1)
+    doc_earnings = {d: int(e) for d, e in zip(doc_ids, earnings_arr)}
+    doc_counts = {d: int(c) for d, c in zip(doc_ids, counts_arr)}
+    total_var = float(np.std(earnings_arr)) if len(doc_ids) else 0
+
+    # 満足度スコア（希望 + 指名 + 優先度）
+    sat = float((pref_hit + nom_hit + pri_weight)[solved].sum())
 
     return {
         "assignments": assignments,
         "doctor_earnings": doc_earnings,
         "doctor_counts": doc_counts,
         "total_variance": total_var,
-        "satisfaction_score": float(sat),
-        "status": pulp.LpStatus[status],
+        "satisfaction_score": sat,
+        # 時間制限で打ち切られた解は LpStatus が "Optimal" でも最適性は未証明
+        "status": "Optimal" if prob.sol_status == pulp.LpSolutionOptimal else "Feasible",
     }
 
 
@@ -339,12 +441,29 @@ def generate_multiple_plans(
         ("preference", "案B: 希望重視"),
         ("affinity", "案C: 優先度重視"),
     ]
-    for mode, label in modes:
-        result = solve_schedule(
+
+    def solve(mode, warm_start=None):
+        return solve_schedule(
             doctors, clinics, saturdays, preferences, affinities,
             mode=mode, previous_earnings=previous_earnings,
-            date_overrides=date_overrides,
+            date_overrides=date_overrides, warm_start=warm_start,
         )
+
+    if _highs_selected():
+        # HiGHS は初期解を使わないため、全モードを最初からまとめて並列に解く
+        with ThreadPoolExecutor(max_workers=len(modes)) as ex:
+            futures = [ex.submit(solve, mode) for mode, _ in modes]
+            results = [f.result() for f in futures]
+    else:
+        # 最初のモードを解き、その解を初期解として残りのモードを並列に解く
+        # （制約は全モード共通。CBC は cbc コマンドの別プロセスで動くため、スレッドで待ち時間を重ねられる）
+        first = solve(modes[0][0])
+        warm_start = first["assignments"] if first else None
+        with ThreadPoolExecutor(max_workers=len(modes) - 1) as ex:
+            futures = [ex.submit(solve, mode, warm_start) for mode, _ in modes[1:]]
+            results = [first] + [f.result() for f in futures]
+
+    for (mode, label), result in zip(modes, results):
         if result:
             result["plan_name"] = label
             result["mode"] = mode
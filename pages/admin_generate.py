@@ -3,12 +3,12 @@ import streamlit as st
 import pandas as pd
 from datetime import date
 from database import (
-    get_doctors, get_clinics, get_all_preferences,
+    get_all_preferences,
     get_affinities, get_schedules, save_schedule, confirm_schedule,
     delete_schedule, update_schedule_assignments,
     get_clinic_date_overrides, get_all_confirmed_schedules,
 )
-from optimizer import get_target_saturdays, generate_multiple_plans
+from optimizer import generate_multiple_plans
 from components.schedule_table import render_schedule_table
 
 
@@ -16,24 +16,40 @@ def _calc_previous_earnings(clinics, target_year, target_month):
     """過去の全確定スケジュールから累計報酬を算出（対象月より前の月のみ）"""
     target_ym = f"{target_year:04d}-{target_month:02d}"
     fee_map = {c["id"]: c["fee"] for c in clinics}
-    earnings = {}
-    confirmed = get_all_confirmed_schedules()
-    months_used = set()
-    for sched in confirmed:
-        if sched["year_month"] < target_ym:
-            months_used.add(sched["year_month"])
-            for a in sched["assignments"]:
-                did = a["doctor_id"]
-                earnings[did] = earnings.get(did, 0) + fee_map.get(a["clinic_id"], 0)
+    past = [s for s in get_all_confirmed_schedules() if s["year_month"] < target_ym]
+    months_used = {s["year_month"] for s in past}
+    df = pd.DataFrame(
+        [(a["doctor_id"], a["clinic_id"]) for s in past for a in s["assignments"]],
+        columns=["doctor_id", "clinic_id"],
+    )
+    if df.empty:
+        return {}, sorted(months_used)
+    df["fee"] = df["clinic_id"].map(fee_map).fillna(0).astype("int64")
+    earnings = {int(k): int(v) for k, v in df.groupby("doctor_id")["fee"].sum().items()}
     return earnings, sorted(months_used)
 
 
-def render(target_month, year, month):
+def _doctor_stats(assignments, doctors, fee_map):
+    """医員別の外勤回数・報酬合計の表（割り当てのない医員は0回）"""
+    adf = pd.DataFrame(assignments, columns=["doctor_id", "clinic_id"])
+    adf["fee"] = adf["clinic_id"].map(fee_map).fillna(0).astype("int64")
+    agg = (
+        adf.groupby("doctor_id")["fee"].agg(["size", "sum"])
+        .reindex([d["id"] for d in doctors], fill_value=0)
+    )
+    return pd.DataFrame({
+        "医員": [d["name"] for d in doctors],
+        "外勤回数": agg["size"].to_numpy(),
+        "報酬合計": [f"¥{int(v):,}" for v in agg["sum"]],
+    })
+
+
+def render(target_month, year, month, ctx):
     st.header(f"スケジュール生成 ({target_month})")
 
-    doctors = get_doctors()
-    clinics = get_clinics()
-    saturdays = get_target_saturdays(year, month)
+    doctors = ctx["doctors"]
+    clinics = ctx["clinics"]
+    saturdays = ctx["saturdays"]
     prefs = get_all_preferences(target_month)
     affinities = get_affinities()
 
@@ -86,143 +102,136 @@ def render(target_month, year, month):
         st.markdown("---")
         st.subheader("生成済みスケジュール案")
 
-        fee_map = {c["id"]: c["fee"] for c in get_clinics()}
-        clinic_map = {c["id"]: c for c in get_clinics()}
+        fee_map = {c["id"]: c["fee"] for c in clinics}
+        clinic_map = {c["id"]: c for c in clinics}
 
         for sched in schedules:
-            confirmed = "[確定]" if sched["is_confirmed"] else ""
-            with st.expander(
-                f"{sched['plan_name']} {confirmed} "
-                f"(分散: {sched['total_variance']:.0f}, "
-                f"満足度: {sched['satisfaction_score']:.1f})",
-                expanded=sched["is_confirmed"]
-            ):
-                # 手動調整モード
-                editing_key = f"editing_sched_{sched['id']}"
-                is_editing = st.session_state.get(editing_key, False)
-
-                if is_editing:
-                    _render_edit_mode(sched, doctors, clinic_map, editing_key)
-                else:
-                    render_schedule_table(sched, get_doctors(), get_clinics())
-
-                    # 医員別統計
-                    st.write("**医員別統計:**")
-                    doc_stats = {}
-                    for a in sched["assignments"]:
-                        did = a["doctor_id"]
-                        if did not in doc_stats:
-                            doc_stats[did] = {"回数": 0, "報酬合計": 0}
-                        doc_stats[did]["回数"] += 1
-                        doc_stats[did]["報酬合計"] += fee_map.get(a["clinic_id"], 0)
-
-                    stat_rows = []
-                    for d in get_doctors():
-                        s = doc_stats.get(d["id"], {"回数": 0, "報酬合計": 0})
-                        stat_rows.append({
-                            "医員": d["name"],
-                            "外勤回数": s["回数"],
-                            "報酬合計": f"¥{s['報酬合計']:,}",
-                        })
+            _schedule_card(sched, doctors, clinics, fee_map, clinic_map)
 
-                    df_stat = pd.DataFrame(stat_rows)
-                    st.dataframe(df_stat, use_container_width=True, hide_index=True)
-
-                    # アクションボタン
-                    btn_cols = st.columns(3)
-                    with btn_cols[0]:
-                        if not sched["is_confirmed"]:
-                            if st.button("確定する", key=f"confirm_{sched['id']}",
-                                         type="primary"):
-                                confirm_schedule(sched["id"])
-                                st.success("確定しました！")
-                                st.rerun()
-                        else:
-                            st.success("確定済み")
-                    with btn_cols[1]:
-                        if st.button("手動調整", key=f"edit_{sched['id']}"):
-                            st.session_state[editing_key] = True
-                            st.rerun()
-                    with btn_cols[2]:
-                        if not sched["is_confirmed"]:
-                            if st.button("削除", key=f"del_{sched['id']}", type="secondary"):
-                                st.session_state[f"confirm_del_sched_{sched['id']}"] = True
-
-                    # 削除確認
-                    if st.session_state.get(f"confirm_del_sched_{sched['id']}"):
-                        st.warning(f"「{sched['plan_name']}」を削除しますか？")
-                        dc1, dc2 = st.columns(2)
-                        with dc1:
-                            if st.button("削除する", key=f"do_del_{sched['id']}", type="primary"):
-                                delete_schedule(sched["id"])
-                                st.session_state.pop(f"confirm_del_sched_{sched['id']}", None)
-                                st.rerun()
-                        with dc2:
-                            if st.button("キャンセル", key=f"cancel_del_{sched['id']}"):
-                                st.session_state.pop(f"confirm_del_sched_{sched['id']}", None)
-                                st.rerun()
-
-
-def _render_edit_mode(sched, doctors, clinic_map, editing_key):
+
+def _set_flag(key, value):
+    """表示切り替え用のセッション状態を設定（None で解除、ボタンのコールバック）"""
+    if value is None:
+        st.session_state.pop(key, None)
+    else:
+        st.session_state[key] = value
+
+
+@st.fragment
+def _schedule_card(sched, doctors, clinics, fee_map, clinic_map):
+    """スケジュール案1件分の表示と操作（カード内のボタン操作ではこのカードだけ再実行される）"""
+    confirmed = "[確定]" if sched["is_confirmed"] else ""
+    with st.expander(
+        f"{sched['plan_name']} {confirmed} "
+        f"(分散: {sched['total_variance']:.0f}, "
+        f"満足度: {sched['satisfaction_score']:.1f})",
+        expanded=sched["is_confirmed"]
+    ):
+        # 手動調整モード
+        editing_key = f"editing_sched_{sched['id']}"
+        is_editing = st.session_state.get(editing_key, False)
+
+        if is_editing:
+            _render_edit_mode(sched, doctors, clinics, clinic_map, editing_key)
+        else:
+            render_schedule_table(sched, doctors, clinics)
+
+            # 医員別統計
+            st.write("**医員別統計:**")
+            df_stat = _doctor_stats(sched["assignments"], doctors, fee_map)
+            st.dataframe(df_stat, use_container_width=True, hide_index=True)
+
+            # アクションボタン
+            btn_cols = st.columns(3)
+            with btn_cols[0]:
+                if not sched["is_confirmed"]:
+                    if st.button("確定する", key=f"confirm_{sched['id']}",
+                                 type="primary"):
+                        confirm_schedule(sched["id"])
+                        st.success("確定しました！")
+                        st.rerun()
+                else:
+                    st.success("確定済み")
+            with btn_cols[1]:
+                st.button("手動調整", key=f"edit_{sched['id']}",
+                          on_click=_set_flag, args=(editing_key, True))
+            with btn_cols[2]:
+                if not sched["is_confirmed"]:
+                    if st.button("削除", key=f"del_{sched['id']}", type="secondary"):
+                        st.session_state[f"confirm_del_sched_{sched['id']}"] = True
+
+            # 削除確認
+            if st.session_state.get(f"confirm_del_sched_{sched['id']}"):
+                st.warning(f"「{sched['plan_name']}」を削除しますか？")
+                dc1, dc2 = st.columns(2)
+                with dc1:
+                    if st.button("削除する", key=f"do_del_{sched['id']}", type="primary"):
+                        delete_schedule(sched["id"])
+                        st.session_state.pop(f"confirm_del_sched_{sched['id']}", None)
+                        st.rerun()
+                with dc2:
+                    st.button("キャンセル", key=f"cancel_del_{sched['id']}",
+                              on_click=_set_flag, args=(f"confirm_del_sched_{sched['id']}", None))
+
+
+def _render_edit_mode(sched, doctors, clinics, clinic_map, editing_key):
     """スケジュールの手動調整UI"""
     st.info("手動調整モード: 各スロットの担当医員を変更できます")
 
     assignments = sched["assignments"]
 
-    # assignments を (date, clinic_id) → doctor_id のマップに変換
+    # (date, clinic_id) → doctor_id のマップと、含まれる日付・外勤先を1パスで抽出
     slot_map = {}
+    dates_set, clinics_set = set(), set()
     for a in assignments:
         slot_map[(a["date"], a["clinic_id"])] = a["doctor_id"]
-
-    # スケジュールに含まれる日付と外勤先を抽出
-    dates = sorted(set(a["date"] for a in assignments))
-    clinics_in_sched = sorted(
-        set(a["clinic_id"] for a in assignments),
-        key=lambda cid: clinic_map.get(cid, {}).get("name", "")
-    )
+        dates_set.add(a["date"])
+        clinics_set.add(a["clinic_id"])
+    dates = sorted(dates_set)
+    # clinics は名前順で取得済みなので、その順のまま絞り込む（マスタにない外勤先は先頭）
+    clinics_in_sched = sorted(cid for cid in clinics_set if cid not in clinic_map)
+    clinics_in_sched += [c["id"] for c in clinics if c["id"] in clinics_set]
 
     doctor_options = [("", "（割り当てなし）")] + [(d["id"], d["name"]) for d in doctors]
+    # 担当医員 id → 選択肢のインデックス
+    idx_of = {did: j for j, (did, _) in enumerate(doctor_options)}
 
+    # フォームにまとめ、スロット変更ごとのリランを保存時の1回に抑える
     new_assignments = []
-    for ds in dates:
-        d_obj = date.fromisoformat(ds)
-        st.write(f"**{d_obj.strftime('%m/%d(%a)')}**")
-        cols = st.columns(min(len(clinics_in_sched), 4))
-        for i, cid in enumerate(clinics_in_sched):
-            if (ds, cid) not in slot_map:
-                continue
-            cname = clinic_map.get(cid, {}).get("name", f"外勤先{cid}")
-            current_did = slot_map.get((ds, cid))
-            with cols[i % len(cols)]:
-                # 現在の担当医員のインデックスを取得
-                current_idx = 0
-                for j, (did, _) in enumerate(doctor_options):
-                    if did == current_did:
-                        current_idx = j
-                        break
-
-                selected = st.selectbox(
-                    cname,
-                    doctor_options,
-                    index=current_idx,
-                    format_func=lambda x: x[1],
-                    key=f"slot_{sched['id']}_{ds}_{cid}",
-                )
-                if selected[0]:  # 割り当てありの場合
-                    new_assignments.append({
-                        "date": ds,
-                        "clinic_id": cid,
-                        "doctor_id": selected[0],
-                    })
-
-    btn_cols = st.columns(2)
-    with btn_cols[0]:
-        if st.button("変更を保存", key=f"save_edit_{sched['id']}", type="primary"):
-            update_schedule_assignments(sched["id"], new_assignments)
-            st.session_state.pop(editing_key, None)
-            st.success("保存しました")
-            st.rerun()
-    with btn_cols[1]:
-        if st.button("キャンセル", key=f"cancel_edit_{sched['id']}"):
-            st.session_state.pop(editing_key, None)
-            st.rerun()
+    with st.form(f"edit_form_{sched['id']}"):
+        for ds in dates:
+            d_obj = date.fromisoformat(ds)
+            st.write(f"**{d_obj.strftime('%m/%d(%a)')}**")
+            cols = st.columns(min(len(clinics_in_sched), 4))
+            for i, cid in enumerate(clinics_in_sched):
+                if (ds, cid) not in slot_map:
+                    continue
+                cname = clinic_map.get(cid, {}).get("name", f"外勤先{cid}")
+                current_did = slot_map.get((ds, cid))
+                with cols[i % len(cols)]:
+                    current_idx = idx_of.get(current_did, 0)
+                    selected = st.selectbox(
+                        cname,
+                        doctor_options,
+                        index=current_idx,
+                        format_func=lambda x: x[1],
+                        key=f"slot_{sched['id']}_{ds}_{cid}",
+                    )
+                    if selected[0]:  # 割り当てありの場合
+                        new_assignments.append({
+                            "date": ds,
+                            "clinic_id": cid,
+                            "doctor_id": selected[0],
+                        })
+
+        btn_cols = st.columns(2)
+        with btn_cols[0]:
+            save = st.form_submit_button("変更を保存", type="primary")
+        with btn_cols[1]:
+            st.form_submit_button("キャンセル", on_click=_set_flag, args=(editing_key, None))
+
+    if save:
+        update_schedule_assignments(sched["id"], new_assignments)
+        st.session_state.pop(editing_key, None)
+        st.success("保存しました")
+        st.rerun()
@@ -3,11 +3,11 @@ import streamlit as st
 from database import (
     get_doctors, add_doctor, update_doctor, delete_doctor,
     get_clinics, add_clinic, update_clinic, delete_clinic,
-    get_affinities, set_affinity,
-    get_clinic_date_overrides, set_clinic_date_override,
+    get_affinities, set_affinities,
+    get_clinic_date_overrides, set_clinic_date_overrides,
     set_doctor_individual_password,
 )
-from optimizer import get_target_saturdays, get_clinic_dates
+from optimizer import get_clinic_dates
 
 
 FREQ_OPTIONS = [
@@ -20,7 +20,98 @@ FREQ_OPTIONS = [
 FREQ_LABELS = {k: v for k, v in FREQ_OPTIONS}
 
 
-def render(target_month, year, month):
+def _clear_flag(key):
+    """表示切り替え用のセッション状態を解除（ボタンのコールバック）"""
+    st.session_state.pop(key, None)
+
+
+@st.fragment
+def _doctor_row(d):
+    """医員1行分の表示と操作（行内のボタン操作ではこの行だけ再実行される）"""
+    has_pw = bool(d.get("password_hash"))
+    pw_icon = "🔑" if has_pw else "⚠️"
+    marker = "row-active" if d['is_active'] else "row-inactive"
+    status_label = "有効" if d['is_active'] else "無効"
+    with st.container(border=True):
+        st.markdown(f'<span class="{marker}"></span>', unsafe_allow_html=True)
+        c1, c2, c3, c4, c5 = st.columns([3, 1, 1, 1, 1])
+        with c1:
+            st.write(f"{status_label} | {d['name']} {pw_icon}")
+        with c2:
+            if d['is_active']:
+                if st.button("無効化", key=f"deact_{d['id']}", type="secondary"):
+                    update_doctor(d['id'], is_active=0)
+                    st.cache_data.clear()
+                    st.rerun()
+            else:
+                if st.button("有効化", key=f"act_{d['id']}"):
+                    update_doctor(d['id'], is_active=1)
+                    st.cache_data.clear()
+                    st.rerun()
+        with c3:
+            if st.button("名前変更", key=f"rename_{d['id']}"):
+                st.session_state[f"editing_doc_{d['id']}"] = True
+        with c4:
+            btn_label = "PW再設定" if has_pw else "初期PW設定"
+            if st.button(btn_label, key=f"setpw_{d['id']}"):
+                st.session_state[f"setting_pw_{d['id']}"] = True
+        with c5:
+            if st.button("削除", key=f"del_doc_{d['id']}", type="secondary"):
+                st.session_state[f"confirm_del_doc_{d['id']}"] = True
+
+    # 名前変更フォーム
+    if st.session_state.get(f"editing_doc_{d['id']}"):
+        with st.form(f"rename_form_{d['id']}"):
+            new_name = st.text_input("新しい名前", value=d["name"])
+            fc1, fc2 = st.columns(2)
+            with fc1:
+                if st.form_submit_button("保存"):
+                    if new_name.strip() and new_name.strip() != d["name"]:
+                        update_doctor(d['id'], name=new_name.strip())
+                        st.cache_data.clear()
+                        st.success("名前を変更しました")
+                    st.session_state.pop(f"editing_doc_{d['id']}", None)
+                    st.rerun()
+            with fc2:
+                st.form_submit_button("キャンセル", on_click=_clear_flag, args=(f"editing_doc_{d['id']}",))
+
+    # パスワード設定フォーム
+    if st.session_state.get(f"setting_pw_{d['id']}"):
+        with st.form(f"setpw_form_{d['id']}"):
+            pw1 = st.text_input("パスワード", type="password", key=f"pw1_{d['id']}")
+            pw2 = st.text_input("パスワード（確認）", type="password", key=f"pw2_{d['id']}")
+            fc1, fc2 = st.columns(2)
+            with fc1:
+                if st.form_submit_button("設定"):
+                    if not pw1:
+                        st.error("パスワードを入力してください")
+                    elif pw1 != pw2:
+                        st.error("パスワードが一致しません")
+                    else:
+                        set_doctor_individual_password(d['id'], pw1)
+                        st.success(f"「{d['name']}」のパスワードを設定しました")
+                        st.session_state.pop(f"setting_pw_{d['id']}", None)
+                        st.rerun()
+            with fc2:
+                st.form_submit_button("キャンセル", on_click=_clear_flag, args=(f"setting_pw_{d['id']}",))
+
+    # 削除確認
+    if st.session_state.get(f"confirm_del_doc_{d['id']}"):
+        st.warning(f"「{d['name']}」を削除しますか？関連データも削除されます。")
+        dc1, dc2 = st.columns(2)
+        with dc1:
+            if st.button("削除する", key=f"do_del_doc_{d['id']}", type="primary"):
+                delete_doctor(d['id'])
+                st.cache_data.clear()
+                st.session_state.pop(f"confirm_del_doc_{d['id']}", None)
+                st.success("削除しました")
+                st.rerun()
+        with dc2:
+            st.button("キャンセル", key=f"cancel_del_doc_{d['id']}",
+                      on_click=_clear_flag, args=(f"confirm_del_doc_{d['id']}",))
+
+
+def render(target_month, year, month, ctx):
     st.header("マスタ管理")
 
     # 行レベルの背景色CSS
@@ -44,94 +135,14 @@ def render(target_month, year, month):
             if st.form_submit_button("追加", use_container_width=True):
                 if new_doc.strip():
                     add_doctor(new_doc.strip())
+                    st.cache_data.clear()
                     st.success(f"「{new_doc}」を追加しました")
                     st.rerun()
 
         doctors_all = get_doctors(active_only=False)
         if doctors_all:
             for d in doctors_all:
-                has_pw = bool(d.get("password_hash"))
-                pw_icon = "🔑" if has_pw else "⚠️"
-                marker = "row-active" if d['is_active'] else "row-inactive"
-                status_label = "有効" if d['is_active'] else "無効"
-                with st.container(border=True):
-                    st.markdown(f'<span class="{marker}"></span>', unsafe_allow_html=True)
-                    c1, c2, c3, c4, c5 = st.columns([3, 1, 1, 1, 1])
-                    with c1:
-                        st.write(f"{status_label} | {d['name']} {pw_icon}")
-                    with c2:
-                        if d['is_active']:
-                            if st.button("無効化", key=f"deact_{d['id']}", type="secondary"):
-                                update_doctor(d['id'], is_active=0)
-                                st.rerun()
-                        else:
-                            if st.button("有効化", key=f"act_{d['id']}"):
-                                update_doctor(d['id'], is_active=1)
-                                st.rerun()
-                    with c3:
-                        if st.button("名前変更", key=f"rename_{d['id']}"):
-                            st.session_state[f"editing_doc_{d['id']}"] = True
-                    with c4:
-                        btn_label = "PW再設定" if has_pw else "初期PW設定"
-                        if st.button(btn_label, key=f"setpw_{d['id']}"):
-                            st.session_state[f"setting_pw_{d['id']}"] = True
-                    with c5:
-                        if st.button("削除", key=f"del_doc_{d['id']}", type="secondary"):
-                            st.session_state[f"confirm_del_doc_{d['id']}"] = True
-
-                # 名前変更フォーム
-                if st.session_state.get(f"editing_doc_{d['id']}"):
-                    with st.form(f"rename_form_{d['id']}"):
-                        new_name = st.text_input("新しい名前", value=d["name"])
-                        fc1, fc2 = st.columns(2)
-                        with fc1:
-                            if st.form_submit_button("保存"):
-                                if new_name.strip() and new_name.strip() != d["name"]:
-                                    update_doctor(d['id'], name=new_name.strip())
-                                    st.success("名前を変更しました")
-                                st.session_state.pop(f"editing_doc_{d['id']}", None)
-                                st.rerun()
-                        with fc2:
-                            if st.form_submit_button("キャンセル"):
-                                st.session_state.pop(f"editing_doc_{d['id']}", None)
-                                st.rerun()
-
-                # パスワード設定フォーム
-                if st.session_state.get(f"setting_pw_{d['id']}"):
-                    with st.form(f"setpw_form_{d['id']}"):
-                        pw1 = st.text_input("パスワード", type="password", key=f"pw1_{d['id']}")
-                        pw2 = st.text_input("パスワード（確認）", type="password", key=f"pw2_{d['id']}")
-                        fc1, fc2 = st.columns(2)
-                        with fc1:
-                            if st.form_submit_button("設定"):
-                                if not pw1:
-                                    st.error("パスワードを入力してください")
-                                elif pw1 != pw2:
-                                    st.error("パスワードが一致しません")
-                                else:
-                                    set_doctor_individual_password(d['id'], pw1)
-                                    st.success(f"「{d['name']}」のパスワードを設定しました")
-                                    st.session_state.pop(f"setting_pw_{d['id']}", None)
-                                    st.rerun()
-                        with fc2:
-                            if st.form_submit_button("キャンセル"):
-                                st.session_state.pop(f"setting_pw_{d['id']}", None)
-                                st.rerun()
-
-                # 削除確認
-                if st.session_state.get(f"confirm_del_doc_{d['id']}"):
-                    st.warning(f"「{d['name']}」を削除しますか？関連データも削除されます。")
-                    dc1, dc2 = st.columns(2)
-                    with dc1:
-                        if st.button("削除する", key=f"do_del_doc_{d['id']}", type="primary"):
-                            delete_doctor(d['id'])
-                            st.session_state.pop(f"confirm_del_doc_{d['id']}", None)
-                            st.success("削除しました")
-                            st.rerun()
-                    with dc2:
-                        if st.button("キャンセル", key=f"cancel_del_doc_{d['id']}"):
-                            st.session_state.pop(f"confirm_del_doc_{d['id']}", None)
-                            st.rerun()
+                _doctor_row(d)
 
     # ---- 外勤先管理 ----
     with col2:
@@ -143,6 +154,7 @@ def render(target_month, year, month):
             if st.form_submit_button("追加", use_container_width=True):
                 if new_clinic.strip():
                     add_clinic(new_clinic.strip(), new_fee, new_freq[0])
+                    st.cache_data.clear()
                     st.success(f"「{new_clinic}」を追加しました")
                     st.rerun()
 
@@ -163,10 +175,12 @@ def render(target_month, year, month):
                         if c['is_active']:
                             if st.button("無効化", key=f"deact_cli_{c['id']}", type="secondary"):
                                 update_clinic(c['id'], is_active=0)
+                                st.cache_data.clear()
                                 st.rerun()
                         else:
                             if st.button("有効化", key=f"act_cli_{c['id']}"):
                                 update_clinic(c['id'], is_active=1)
+                                st.cache_data.clear()
                                 st.rerun()
                     with cc3:
                         if st.button("編集", key=f"edit_cli_{c['id']}"):
@@ -193,6 +207,7 @@ def render(target_month, year, month):
                         with fc1:
                             if st.form_submit_button("保存"):
                                 update_clinic(c['id'], fee=edit_fee, frequency=edit_freq[0])
+                                st.cache_data.clear()
                                 st.session_state.pop(f"editing_cli_{c['id']}", None)
                                 st.success("保存しました")
                                 st.rerun()
@@ -205,8 +220,8 @@ def render(target_month, year, month):
     st.markdown("---")
     st.subheader("外勤先の指名・優先度設定")
 
-    clinics = get_clinics()
-    doctors = get_doctors()
+    clinics = ctx["clinics"]
+    doctors = ctx["doctors"]
 
     if clinics and doctors:
         selected_clinic = st.selectbox(
@@ -220,15 +235,17 @@ def render(target_month, year, month):
             pref_docs = selected_clinic.get("preferred_doctors", [])
 
             st.write("**指名医員（この外勤先が希望する医員）:**")
+            doctor_names = {d["id"]: d["name"] for d in doctors}
             new_pref = st.multiselect(
                 "指名医員",
-                [d["id"] for d in doctors],
-                default=[did for did in pref_docs if did in [d["id"] for d in doctors]],
-                format_func=lambda did: next((d["name"] for d in doctors if d["id"] == did), str(did)),
+                list(doctor_names),
+                default=[did for did in pref_docs if did in doctor_names],
+                format_func=lambda did: doctor_names.get(did, str(did)),
                 label_visibility="collapsed"
             )
             if st.button("指名を保存"):
                 update_clinic(selected_clinic["id"], preferred_doctors=new_pref)
+                st.cache_data.clear()
                 st.success("保存しました")
                 st.rerun()
 
@@ -243,21 +260,29 @@ def render(target_month, year, month):
             PRIORITY_OPTIONS = {"○ 行くときもある": 1.0, "◎ 必ず行く": 2.0, "× 行かない": 0.0}
             WEIGHT_TO_LABEL = {2.0: "◎ 必ず行く", 1.0: "○ 行くときもある", 0.0: "× 行かない"}
 
-            aff_cols = st.columns(4)
-            for i, d in enumerate(doctors):
-                with aff_cols[i % 4]:
-                    current_w = current_affinities.get(d["id"], 1.0)
-                    current_label = WEIGHT_TO_LABEL.get(current_w, "○ 行くときもある")
-                    selected = st.radio(
-                        d["name"],
-                        list(PRIORITY_OPTIONS.keys()),
-                        index=list(PRIORITY_OPTIONS.keys()).index(current_label),
-                        key=f"pri_{selected_clinic['id']}_{d['id']}",
-                        horizontal=True,
-                    )
-                    new_w = PRIORITY_OPTIONS[selected]
-                    if new_w != current_w:
-                        set_affinity(d["id"], selected_clinic["id"], new_w)
+            # 変更はフォーム送信時にまとめて保存する（ラジオ操作ごとの書き込みを避ける）
+            with st.form(f"affinity_form_{selected_clinic['id']}"):
+                aff_cols = st.columns(4)
+                aff_changes = []
+                for i, d in enumerate(doctors):
+                    with aff_cols[i % 4]:
+                        current_w = current_affinities.get(d["id"], 1.0)
+                        current_label = WEIGHT_TO_LABEL.get(current_w, "○ 行くときもある")
+                        selected = st.radio(
+                            d["name"],
+                            list(PRIORITY_OPTIONS.keys()),
+                            index=list(PRIORITY_OPTIONS.keys()).index(current_label),
+                            key=f"pri_{selected_clinic['id']}_{d['id']}",
+                            horizontal=True,
+                        )
+                        new_w = PRIORITY_OPTIONS[selected]
+                        if new_w != current_w:
+                            aff_changes.append((d["id"], selected_clinic["id"], new_w))
+                submitted = st.form_submit_button("優先度を保存", type="primary")
+            if submitted:
+                if aff_changes:
+                    set_affinities(aff_changes)
+                st.success("保存しました")
 
     # ---- 外勤先の日別設定 ----
     st.markdown("---")
@@ -273,7 +298,7 @@ def render(target_month, year, month):
         )
 
         if override_clinic:
-            saturdays = get_target_saturdays(year, month)
+            saturdays = ctx["saturdays"]
             clinic_sats = get_clinic_dates(override_clinic, saturdays)
             overrides = get_clinic_date_overrides(target_month)
 
@@ -302,7 +327,6 @@ def render(target_month, year, month):
                             changes[(override_clinic["id"], ds)] = new_req
 
                 if st.button("日別設定を保存", type="primary", key="save_overrides"):
-                    for (cid, ds), req in changes.items():
-                        set_clinic_date_override(cid, ds, req)
+                    set_clinic_date_overrides(changes)
                     st.success("保存しました")
                     st.rerun()
@@ -1,45 +1,39 @@
 """管理者: 希望状況一覧タブ"""
 import streamlit as st
+import numpy as np
 import pandas as pd
-from database import get_doctors, get_all_preferences
-from optimizer import get_target_saturdays
+from database import get_all_preferences
 
 
-def render(target_month, year, month):
+def render(target_month, year, month, ctx):
     st.header(f"希望状況一覧 ({target_month})")
 
-    doctors = get_doctors()
+    doctors = ctx["doctors"]
     prefs = get_all_preferences(target_month)
     pref_map = {p["doctor_id"]: p for p in prefs}
 
-    saturdays = get_target_saturdays(year, month)
+    saturdays = ctx["saturdays"]
     sat_strs = [s.strftime("%m/%d") for s in saturdays]
 
     if doctors:
-        data = []
-        for d in doctors:
+        # 行=医員、列=土曜日のグリッドを日付マスクでまとめて埋める
+        sat_iso = np.array([s.isoformat() for s in saturdays])
+        grid = np.full((len(doctors), len(sat_iso)), "-", dtype=object)
+        entered = []
+        for i, d in enumerate(doctors):
             p = pref_map.get(d["id"])
-            row = {"医員": d["name"], "入力済": "済" if p else "-"}
+            entered.append("済" if p else "-")
             if p:
-                ng = set(p.get("ng_dates", []))
-                avoid = set(p.get("avoid_dates", []))
-                for s, s_str in zip(saturdays, sat_strs):
-                    ds = s.isoformat()
-                    if ds in ng:
-                        row[s_str] = "×"
-                    elif ds in avoid:
-                        row[s_str] = "△"
-                    else:
-                        row[s_str] = "○"
-            else:
-                for s_str in sat_strs:
-                    row[s_str] = "-"
-            data.append(row)
+                ng_mask = np.isin(sat_iso, p.get("ng_dates", []))
+                avoid_mask = np.isin(sat_iso, p.get("avoid_dates", []))
+                grid[i] = np.where(ng_mask, "×", np.where(avoid_mask, "△", "○"))
 
-        df = pd.DataFrame(data)
+        df = pd.DataFrame(grid, columns=sat_strs)
+        df.insert(0, "入力済", entered)
+        df.insert(0, "医員", [d["name"] for d in doctors])
         st.dataframe(df, use_container_width=True, hide_index=True)
 
-        submitted = sum(1 for _ in pref_map.values())
+        submitted = len(pref_map)
         st.info(f"入力済: {submitted}/{len(doctors)}人")
     else:
         st.warning("医員が登録されていません。マスタ管理で追加してください。")
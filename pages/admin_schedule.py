@@ -1,10 +1,10 @@
 """管理者: 確定スケジュール確認タブ"""
 import streamlit as st
-from database import get_doctors, get_clinics, get_schedules
+from database import get_schedules
 from components.schedule_table import render_schedule_table
 
 
-def render(target_month):
+def render(target_month, ctx):
     st.header(f"確定スケジュール ({target_month})")
 
     schedules = get_schedules(target_month)
@@ -12,7 +12,7 @@ def render(target_month):
 
     if confirmed:
         sched = confirmed[0]
-        df = render_schedule_table(sched, get_doctors(), get_clinics())
+        df = render_schedule_table(sched, ctx["doctors"], ctx["clinics"])
 
         # CSV出力
         if df is not None:
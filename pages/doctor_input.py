@@ -1,18 +1,17 @@
 """医員: 希望入力タブ"""
 import streamlit as st
-from database import get_clinics, get_preference, upsert_preference
-from optimizer import get_target_saturdays
+from database import get_preference, upsert_preference
 
 
 DAY_STATUS_OPTIONS = ["○ 可能", "△ できれば避けたい", "× NG"]
 
 
-def render(doctor, target_month, year, month):
+def render(doctor, target_month, year, month, ctx):
     st.header(f"希望入力 ({target_month})")
     st.write(f"**{doctor['name']}** さんの希望を入力してください")
 
-    saturdays = get_target_saturdays(year, month)
-    clinics = get_clinics()
+    saturdays = ctx["saturdays"]
+    clinics = ctx["clinics"]
 
     existing = get_preference(doctor["id"], target_month)
     existing_ng = set(existing["ng_dates"]) if existing else set()
@@ -1,11 +1,11 @@
 """医員: スケジュール確認タブ"""
 import streamlit as st
 from datetime import date
-from database import get_doctors, get_clinics, get_schedules
+from database import get_schedules
 from components.schedule_table import render_schedule_table
 
 
-def render(doctor, target_month):
+def render(doctor, target_month, ctx):
     st.header(f"確定スケジュール ({target_month})")
 
     schedules = get_schedules(target_month)
@@ -13,7 +13,7 @@ def render(doctor, target_month):
 
     if confirmed:
         sched = confirmed[0]
-        clinics = get_clinics()
+        clinics = ctx["clinics"]
         clinic_map = {c["id"]: c["name"] for c in clinics}
 
         # 自分の担当だけハイライト
@@ -34,6 +34,6 @@ def render(doctor, target_month):
         # 全体表示
         st.markdown("---")
         st.subheader("全体スケジュール")
-        render_schedule_table(sched, get_doctors(), clinics)
+        render_schedule_table(sched, ctx["doctors"], clinics)
     else:
         st.info("まだスケジュールが確定されていません")
@@ -1,15 +1,19 @@
 """
 テスト用サンプルデータ投入スクリプト
-医員20人、外勤先10ヶ所を登録
+医員20人、外勤先10ヶ所を登録（登録済みのデータはスキップするため再実行しても重複しない）
 """
 import sys
 import os
 sys.path.insert(0, os.path.dirname(__file__))
 
-from database import init_db, add_doctor, add_clinic, set_affinity, get_doctors, get_clinics, update_clinic
-import json
+from database import (
+    init_db, add_doctors, add_clinics, get_doctors, get_clinics,
+    get_affinities, set_affinities,
+)
 import random
 
+import numpy as np
+
 init_db()
 
 # 医員20人
@@ -20,8 +24,7 @@ doctor_names = [
     "林和也", "斎藤早紀", "清水浩二", "山口亮", "阿部綾乃",
 ]
 
-for name in doctor_names:
-    add_doctor(name)
+add_doctors(doctor_names)
 
 # 外勤先10ヶ所
 clinic_data = [
@@ -37,25 +40,29 @@ clinic_data = [
     ("J診療所", 40000, "first_only"),
 ]
 
-for name, fee, freq in clinic_data:
-    add_clinic(name, fee, freq)
-
-# 指名・相性をランダムに設定
+# 指名・相性をランダムに設定（各シートへの書き込みは1回ずつにまとめる）
 doctors = get_doctors()
-clinics = get_clinics()
+doctor_ids = [d["id"] for d in doctors]
 
 random.seed(42)
 
-for c in clinics:
-    # 各外勤先に2-3人の指名
-    preferred = random.sample([d["id"] for d in doctors], k=random.randint(2, 3))
-    update_clinic(c["id"], preferred_doctors=preferred)
+# 各外勤先に2-3人の指名
+add_clinics([
+    (name, fee, freq, random.sample(doctor_ids, k=random.randint(2, 3)))
+    for name, fee, freq in clinic_data
+])
+clinics = get_clinics()
 
-    # 相性スコア
-    for d in doctors:
-        if random.random() < 0.3:
-            weight = round(random.uniform(1.0, 5.0), 1)
-            set_affinity(d["id"], c["id"], weight)
+# 相性スコア（設定済みなら再投入しない）
+if not get_affinities():
+    # 外勤先×医員の全組み合わせについて、3割の確率で 1.0〜5.0 のスコアを一括で抽選
+    rng = np.random.default_rng(42)
+    mask = rng.random((len(clinics), len(doctors))) < 0.3
+    weights = np.round(rng.uniform(1.0, 5.0, size=mask.shape), 1)
+    set_affinities([
+        (doctors[j]["id"], clinics[i]["id"], float(weights[i, j]))
+        for i, j in np.argwhere(mask)
+    ])
 
 print(f"サンプルデータ投入完了")
 print(f"   医員: {len(doctors)}人")